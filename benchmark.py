@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Webhook throughput benchmark: Passenger path (a2wsgi) vs native ASGI (uvicorn).
+
+Each mode is started in a subprocess serving on a local port - the WSGI mode
+through passenger_wsgi.application on a single-threaded WSGI server (as
+Passenger runs one request at a time per instance), the ASGI mode under a
+single uvicorn worker. The Bot API is replaced with an in-process fake that
+answers after --api-latency seconds, and the database is a temporary SQLite
+file, so no token or network access is needed.
+
+    python benchmark.py --requests 2000 --concurrency 50
+    python benchmark.py --inline          # UPDATE_WORKERS=0: answer after processing
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TOKEN = "123456:benchmark"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _install_fake_api(latency: float):
+    """Answer Bot API calls locally after ``latency`` seconds"""
+    from telebot import asyncio_helper
+
+    message_ids = itertools.count(1)
+
+    async def fake_request(token, url, method='get', params=None, files=None, **kwargs):
+        await asyncio.sleep(latency)
+        if url in ('sendMessage', 'forwardMessage', 'sendDocument', 'editMessageText'):
+            return {"message_id": next(message_ids), "date": 0, "chat": {"id": 1, "type": "private"}}
+        return True
+
+    asyncio_helper._process_request = fake_request
+
+
+def serve(mode: str, port: int, latency: float):
+    """Subprocess: run the app in ``mode`` on ``port``"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    _install_fake_api(latency)
+    if mode == "asgi":
+        import uvicorn
+        uvicorn.run("main:app", host="127.0.0.1", port=port, workers=1, lifespan="on", log_level="warning")
+    else:
+        from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        from passenger_wsgi import application
+        make_server("127.0.0.1", port, application, handler_class=QuietHandler).serve_forever()
+
+
+def _update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+        },
+    }
+
+
+async def _load(port: int, requests: int, concurrency: int) -> dict:
+    import aiohttp
+
+    url = f"http://127.0.0.1:{port}/webhook/{TOKEN}"
+    latencies = []
+    errors = 0
+    counter = itertools.count(1)
+
+    async with aiohttp.ClientSession() as session:
+        # Wait for the server to come up
+        for _ in range(200):
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/health") as resp:
+                    if resp.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError(f"Server on port {port} did not start")
+
+        async def client():
+            nonlocal errors
+            while True:
+                update_id = next(counter)
+                if update_id > requests:
+                    return
+                started = time.perf_counter()
+                try:
+                    async with session.post(url, json=_update(update_id, 10_000 + update_id % 500)) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+def run(mode: str, args) -> dict:
+    port = _free_port()
+    workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=TOKEN,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        STATE_STORAGE="memory",
+        UPDATE_WORKERS="0" if args.inline else os.environ.get("UPDATE_WORKERS", "4"),
+        LOG_RATE_LIMIT=os.environ.get("LOG_RATE_LIMIT", "1"),
+        LOG_DIR=os.path.join(workdir, "logs"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port),
+         "--api-latency", str(args.api_latency)],
+        env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        return asyncio.run(_load(port, args.requests, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="simulated Bot API round trip (seconds)")
+    parser.add_argument("--inline", action="store_true", help="process updates before answering (UPDATE_WORKERS=0)")
+    parser.add_argument("--modes", default="wsgi,asgi")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.api_latency)
+        return
+
+    print(f"{args.requests} webhook requests, concurrency {args.concurrency}, "
+          f"Bot API latency {args.api_latency * 1000:.0f} ms, {'inline' if args.inline else 'queued'} processing")
+    print(f"{'mode':<6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for mode in args.modes.split(","):
+        result = run(mode, args)
+        print(f"{mode:<6}{result['rps']:>10.1f}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,54 @@
 from telebot.async_telebot import AsyncTeleBot
-from telebot import types
+from telebot import types, util, asyncio_helper
 from telebot.asyncio_handler_backends import State, StatesGroup
-from telebot.asyncio_storage import StateMemoryStorage
+import asyncio
 import config
-import json
-import re
 from datetime import datetime
-from database import SessionLocal
-from models.User import User
-from models.Address import Address
-from models.Project import Project
+from database import AsyncSessionLocal
+from models.Project import Project, PROJECT_PENDING
 import logging
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-import os
-import tempfile
+from state_storage import create_state_storage, save_record
+from gazetteer import get_gazetteer
+import keyboards
+import stats
+import user_cache
+import registrations
+import maintenance
+import metrics
+import bot_session
+import send_scheduler
+from export_jobs import ExportJobManager, data_version, get_watermark, save_watermark
+from exporter import ExportWindow
+from channel_outbox import ChannelOutbox
+from router import Router
+import flow
 
 logger = logging.getLogger(__name__)
 
-# Initialize bot with state storage
-state_storage = StateMemoryStorage()
+# One keep-alive HTTP session per process for all Bot API calls
+bot_session.install()
+
+# Time every Bot API call (sendMessage, forwardMessage, sendDocument, ...)
+metrics.time_telegram_requests(asyncio_helper)
+
+# Rate-limit, prioritize and retry outgoing messages (wraps the timed requests,
+# so the histograms above measure Telegram, not time spent waiting)
+send_scheduler.install()
+
+# Initialize bot with state storage shared between worker processes
+state_storage = create_state_storage()
 bot = AsyncTeleBot(config.TOKEN, state_storage=state_storage)
 
+# Messages are routed by command, button text or (state, content type) lookup
+router = Router(bot)
+
+# Admin exports are built in background threads and cached per data version
+export_jobs = ExportJobManager(bot, workers=config.EXPORT_WORKERS, cache_ttl=config.EXPORT_CACHE_TTL)
+
+# Projects are committed as pending and forwarded to the channel in the background
+channel_outbox = ChannelOutbox(bot, poll_interval=config.OUTBOX_POLL_INTERVAL,
+                               max_attempts=config.OUTBOX_MAX_ATTEMPTS)
+
 # Define states for registration flow
 class RegistrationStates(StatesGroup):
     full_name = State()
@@ -54,33 +81,21 @@ Bag'rikenglik, do'stlik va birlik g'oyalarini ifodalovchi ijodingizni bizga yubo
 
 Ro'yxatdan o'tish uchun tugmani bosing 👇"""
 
-# Load regions data
-def load_regions():
-    try:
-        with open("regions.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading regions: {e}")
-        return {}
-
-@bot.message_handler(commands=['start'])
+@router.command('start')
 async def welcome_handler(message: types.Message):
     """Handle /start command"""
     user_id = message.from_user.id
     username = message.from_user.username or "no_username"
     logger.info(f"User {user_id} (@{username}) started the bot with /start command")
     
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    
     # Check if user is admin
-    if message.from_user.id in config.ADMIN_IDS:
+    is_admin = message.from_user.id in config.ADMIN_IDS
+    if is_admin:
         logger.info(f"Admin access granted for user {user_id}")
-        markup.add(types.KeyboardButton("👤 Ro'yxatdan o'tish"))
-        markup.add(types.KeyboardButton("📊 Ma'lumotlarni yuklab olish (Admin)"))
         admin_note = "\n\n🔐 <b>Admin panel mavjud!</b>"
     else:
-        markup.add(types.KeyboardButton("👤 Ro'yxatdan o'tish"))
         admin_note = ""
+    markup = keyboards.main_menu(is_admin)
     
     await bot.send_message(
         message.from_user.id,
@@ -90,7 +105,7 @@ async def welcome_handler(message: types.Message):
     )
     logger.info(f"Welcome message sent to user {user_id}")
 
-@bot.message_handler(commands=['clear_results'])
+@router.command('clear_results')
 async def clear_results_handler(message: types.Message):
     """Clear all database results (Admin only)"""
     user_id = message.from_user.id
@@ -107,11 +122,7 @@ async def clear_results_handler(message: types.Message):
     logger.warning(f"Admin {user_id} initiated database clear request")
     
     # Ask for confirmation
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    markup.add(
-        types.KeyboardButton("✅ Ha, barcha ma'lumotlarni o'chirish"),
-        types.KeyboardButton("❌ Yo'q, bekor qilish")
-    )
+    markup = keyboards.clear_confirmation()
     
     await bot.send_message(
         message.from_user.id,
@@ -126,7 +137,7 @@ async def clear_results_handler(message: types.Message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: message.text == "✅ Ha, barcha ma'lumotlarni o'chirish")
+@router.button("✅ Ha, barcha ma'lumotlarni o'chirish")
 async def confirm_clear_database(message: types.Message):
     """Confirm and clear database (Admin only)"""
     user_id = message.from_user.id
@@ -145,40 +156,28 @@ async def confirm_clear_database(message: types.Message):
     await bot.send_message(
         message.from_user.id,
         "⏳ Ma'lumotlar o'chirilmoqda...",
-        reply_markup=types.ReplyKeyboardRemove()
+        reply_markup=keyboards.remove()
     )
     
-    db = SessionLocal()
     try:
-        # Count records before deletion
-        users_count = db.query(User).count()
-        addresses_count = db.query(Address).count()
-        projects_count = db.query(Project).count()
-        
-        logger.warning(f"Deleting {users_count} users, {addresses_count} addresses, {projects_count} projects")
-        
-        # Delete all records (order matters due to foreign keys)
-        db.query(Project).delete()
-        db.query(User).delete()
-        db.query(Address).delete()
+        # Archive (optionally) and truncate in one set-based transaction
+        result = await maintenance.clear_results(archive=config.CLEAR_RESULTS_ARCHIVE)
+        await user_cache.clear()
         
-        db.commit()
-        
-        logger.critical(f"Database cleared successfully by admin {user_id}: {users_count} users, {addresses_count} addresses, {projects_count} projects deleted")
+        logger.critical(f"Database cleared successfully by admin {user_id}: {result.users} users, {result.addresses} addresses, {result.projects} projects deleted")
         
         # Show success message
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        if user_id in config.ADMIN_IDS:
-            markup.add(types.KeyboardButton("👤 Ro'yxatdan o'tish"))
-            markup.add(types.KeyboardButton("📊 Ma'lumotlarni yuklab olish (Admin)"))
+        markup = keyboards.main_menu(user_id in config.ADMIN_IDS)
+        archive_note = f"🗄 Arxiv: <code>{result.archive_prefix}_*</code>\n\n" if result.archive_prefix else ""
         
         await bot.send_message(
             message.from_user.id,
             f"✅ <b>Barcha ma'lumotlar o'chirildi!</b>\n\n"
-            f"📊 O'chirilgan ma'lumotlar:\n"
-            f"• Foydalanuvchilar: {users_count}\n"
-            f"• Manzillar: {addresses_count}\n"
-            f"• Loyihalar: {projects_count}\n\n"
+            f"📊 O'chirilgan ma'lumotlar (taxminan):\n"
+            f"• Foydalanuvchilar: {result.users}\n"
+            f"• Manzillar: {result.addresses}\n"
+            f"• Loyihalar: {result.projects}\n\n"
+            f"{archive_note}"
             f"Database endi bo'sh.",
             parse_mode='HTML',
             reply_markup=markup
@@ -186,12 +185,8 @@ async def confirm_clear_database(message: types.Message):
         
     except Exception as e:
         logger.error(f"Error clearing database: {e}", exc_info=True)
-        db.rollback()
         
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        if user_id in config.ADMIN_IDS:
-            markup.add(types.KeyboardButton("👤 Ro'yxatdan o'tish"))
-            markup.add(types.KeyboardButton("📊 Ma'lumotlarni yuklab olish (Admin)"))
+        markup = keyboards.main_menu(user_id in config.ADMIN_IDS)
         
         await bot.send_message(
             message.from_user.id,
@@ -199,21 +194,14 @@ async def confirm_clear_database(message: types.Message):
             f"Iltimos, qaytadan urinib ko'ring.",
             reply_markup=markup
         )
-    finally:
-        db.close()
 
-@bot.message_handler(func=lambda message: message.text == "❌ Yo'q, bekor qilish")
+@router.button("❌ Yo'q, bekor qilish")
 async def cancel_clear_database(message: types.Message):
     """Cancel database clear operation"""
     user_id = message.from_user.id
     logger.info(f"Admin {user_id} cancelled database clear")
     
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    if user_id in config.ADMIN_IDS:
-        markup.add(types.KeyboardButton("👤 Ro'yxatdan o'tish"))
-        markup.add(types.KeyboardButton("📊 Ma'lumotlarni yuklab olish (Admin)"))
-    else:
-        markup.add(types.KeyboardButton("👤 Ro'yxatdan o'tish"))
+    markup = keyboards.main_menu(user_id in config.ADMIN_IDS)
     
     await bot.send_message(
         message.from_user.id,
@@ -221,278 +209,37 @@ async def cancel_clear_database(message: types.Message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: message.text == "👤 Ro'yxatdan o'tish")
+@router.button("👤 Ro'yxatdan o'tish")
 async def start_registration(message: types.Message):
     """Start registration process"""
     user_id = message.from_user.id
     logger.info(f"User {user_id} clicked registration button")
     
     # Check if user already exists
-    db = SessionLocal()
-    try:
-        existing_user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if existing_user:
-            logger.info(f"User {user_id} already registered, showing options")
-            # User already registered, show options
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-            markup.add(
-                types.KeyboardButton("➕ Loyiha yuborish"),
-                types.KeyboardButton("✏️ Ma'lumotlarni tahrirlash"),
-                types.KeyboardButton("🏠 Bosh sahifa")
-            )
-            
-            await bot.send_message(
-                message.from_user.id,
-                "✅ Siz allaqachon ro'yxatdan o'tgansiz!\n\n"
-                "Quyidagi variantlardan birini tanlang:",
-                reply_markup=markup
-            )
-            return
-    finally:
-        db.close()
-    
-    # Ask for full name
-    logger.info(f"Starting new registration flow for user {user_id}")
-    markup = types.ReplyKeyboardRemove()
-    await bot.send_message(
-        message.from_user.id,
-        "📝 Iltimos, to'liq ismingizni kiriting:\n(Masalan: Aliyev Vali Akramovich)",
-        reply_markup=markup
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.full_name, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.full_name)
-async def process_full_name(message: types.Message):
-    """Process full name input"""
-    # Check if user is editing
-    is_editing = False
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        is_editing = 'phone_number' in data and data.get('phone_number') is not None
-        data['full_name'] = message.text
-    
-    if is_editing:
-        await show_confirmation(message)
-        return
-    
-    # Show regions (normal flow)
-    regions = load_regions()
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    
-    for region_id, region_data in regions.items():
-        markup.add(types.KeyboardButton(region_data['name']))
-    
-    await bot.send_message(
-        message.from_user.id,
-        "📍 Viloyatingizni tanlang:",
-        reply_markup=markup
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.region, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.region)
-async def process_region(message: types.Message):
-    """Process region selection"""
-    regions = load_regions()
-    selected_region = None
-    
-    # Find selected region
-    for region_id, region_data in regions.items():
-        if region_data['name'] == message.text:
-            selected_region = region_id
-            break
-    
-    if not selected_region:
-        await bot.send_message(message.from_user.id, "❗️ Iltimos, tugmalardan birini tanlang!")
-        return
-    
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data['region_id'] = selected_region
-    
-    # Show districts
-    districts = regions[selected_region].get('districts', {})
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    
-    for district_id, district_data in districts.items():
-        markup.add(types.KeyboardButton(district_data['name']))
-    
-    await bot.send_message(
-        message.from_user.id,
-        "🏘 Tumaningizni tanlang:",
-        reply_markup=markup
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.district, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.district)
-async def process_district(message: types.Message):
-    """Process district selection"""
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        region_id = data.get('region_id')
-    
-    regions = load_regions()
-    districts = regions[region_id].get('districts', {})
-    selected_district = None
-    
-    # Find selected district
-    for district_id, district_data in districts.items():
-        if district_data['name'] == message.text:
-            selected_district = district_id
-            break
-    
-    if not selected_district:
-        await bot.send_message(message.from_user.id, "❗️ Iltimos, tugmalardan birini tanlang!")
-        return
-    
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data['district_id'] = selected_district
-        data['district_name'] = message.text
-    
-    # Ask for mahalla
-    markup = types.ReplyKeyboardRemove()
-    await bot.send_message(
-        message.from_user.id,
-        "� Mahalla nomini kiriting:\n(Masalan: Yangi hayot mahallasi)",
-        reply_markup=markup
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.mahalla, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.mahalla)
-async def process_mahalla(message: types.Message):
-    """Process mahalla input"""
-    # Check if user is editing
-    is_editing = False
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        is_editing = 'phone_number' in data and data.get('phone_number') is not None
-        data['mahalla'] = message.text
-    
-    if is_editing:
-        await show_confirmation(message)
-        return
-    
-    # Ask for workplace
-    await bot.send_message(
-        message.from_user.id,
-        "🏢 Ish joyingizni kiriting:\n(Masalan: Toshkent davlat universiteti)"
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.workplace, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.workplace)
-async def process_workplace(message: types.Message):
-    """Process workplace input"""
-    # Check if user is editing
-    is_editing = False
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        is_editing = 'phone_number' in data and data.get('phone_number') is not None
-        data['workplace'] = message.text
-    
-    if is_editing:
-        await show_confirmation(message)
-        return
-    
-    await bot.send_message(
-        message.from_user.id,
-        "📅 Tug'ilgan sanangizni kiriting:\n(Masalan: 01.01.2000)"
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.birth_date, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.birth_date)
-async def process_birth_date(message: types.Message):
-    """Process birth date input"""
-    # Validate date format DD.MM.YYYY
-    date_pattern = r'^\d{2}\.\d{2}\.\d{4}$'
-    if not re.match(date_pattern, message.text):
-        await bot.send_message(
-            message.from_user.id,
-            "❌ Noto'g'ri format! Iltimos, sanani DD.MM.YYYY formatida kiriting.\n(Masalan: 01.01.2000)"
-        )
-        return
-    
-    # Validate if it's a real date
-    try:
-        day, month, year = message.text.split('.')
-        datetime(int(year), int(month), int(day))
-    except ValueError:
-        await bot.send_message(
-            message.from_user.id,
-            "❌ Noto'g'ri sana! Iltimos, mavjud sanani kiriting.\n(Masalan: 01.01.2000)"
-        )
-        return
-    
-    # Check if user is editing
-    is_editing = False
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        is_editing = 'phone_number' in data and data.get('phone_number') is not None
-        data['birth_date'] = message.text
-    
-    if is_editing:
-        await show_confirmation(message)
-        return
-    
-    await bot.send_message(
-        message.from_user.id,
-        "🆔 Pasport seriya va raqamingizni kiriting:\n(Masalan: AA1234567)"
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.passport_series, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.passport_series)
-async def process_passport(message: types.Message):
-    """Process passport input"""
-    # Validate passport format: 2 letters (any case) + 7 digits (e.g., AA1234567 or aa1234567)
-    passport_pattern = r'^[A-Za-z]{2}\d{7}$'
-    if not re.match(passport_pattern, message.text):
+    registration = await user_cache.get_registration(message.from_user.id)
+    if registration.registered:
+        logger.info(f"User {user_id} already registered, showing options")
+        # User already registered, show options
+        markup = keyboards.registered_menu()
+        
         await bot.send_message(
             message.from_user.id,
-            "❌ Noto'g'ri format! Pasport seriyasi 2 ta harf va 7 ta raqamdan iborat bo'lishi kerak.\n(Masalan: AA1234567)"
+            "✅ Siz allaqachon ro'yxatdan o'tgansiz!\n\n"
+            "Quyidagi variantlardan birini tanlang:",
+            reply_markup=markup
         )
         return
     
-    # Convert to uppercase before storing
-    passport_upper = message.text.upper()
-    
-    # Check if user is editing
-    is_editing = False
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        is_editing = 'phone_number' in data and data.get('phone_number') is not None
-        data['passport_series'] = passport_upper
-    
-    if is_editing:
-        await show_confirmation(message)
-        return
-    
-    # Request phone number
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(types.KeyboardButton("📱 Telefon raqamni yuborish", request_contact=True))
-    
-    await bot.send_message(
-        message.from_user.id,
-        "📱 Telefon raqamingizni yuboring:",
-        reply_markup=markup
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.phone_number, message.chat.id)
-
-@bot.message_handler(state=RegistrationStates.phone_number, content_types=['contact', 'text'])
-async def process_phone(message: types.Message):
-    """Process phone number input"""
-    phone_number = None
-    
-    if message.content_type == 'contact':
-        phone_number = message.contact.phone_number
-    else:
-        phone_number = message.text
-    
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data['phone_number'] = phone_number
-    
-    # Show confirmation with all data
-    await show_confirmation(message)
+    # Ask for full name
+    logger.info(f"Starting new registration flow for user {user_id}")
+    await registration_flow.enter(message, registration_flow.step(RegistrationStates.full_name), {})
 
-async def show_confirmation(message: types.Message):
+async def show_confirmation(message: types.Message, data: dict):
     """Show user data for confirmation"""
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        # Load regions to get region and district names
-        regions = load_regions()
-        region_name = regions.get(data['region_id'], {}).get('name', 'N/A')
-        district_name = data.get('district_name', 'N/A')
-        
-        confirmation_text = f"""
+    region_name = get_gazetteer().region_name(data['region_id'])
+    district_name = data.get('district_name', 'N/A')
+    
+    confirmation_text = f"""
 📋 <b>Ma'lumotlaringizni tekshiring:</b>
 
 👤 <b>To'liq ism:</b> {data.get('full_name', 'N/A')}
@@ -507,11 +254,7 @@ async def show_confirmation(message: types.Message):
 Ma'lumotlar to'g'rimi?
 """
     
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    markup.add(
-        types.KeyboardButton("✅ Ha, to'g'ri"),
-        types.KeyboardButton("✏️ Tahrirlash")
-    )
+    markup = keyboards.confirmation()
     
     await bot.send_message(
         message.from_user.id,
@@ -519,86 +262,187 @@ Ma'lumotlar to'g'rimi?
         parse_mode='HTML',
         reply_markup=markup
     )
-    await bot.set_state(message.from_user.id, RegistrationStates.confirmation, message.chat.id)
+    await save_record(state_storage, message.chat.id, message.from_user.id, RegistrationStates.confirmation, data)
+
+# Registration form steps: parsers validate and normalise the answer, the flow
+# engine stores it and asks the next question
+
+PROJECT_TYPE_KEYS = {info['title']: key for key, info in config.PROJECT_TYPES.items()}
+
+def parse_region(message: types.Message, data: dict) -> dict:
+    region_id = get_gazetteer().region_id(message.text)
+    if not region_id:
+        raise flow.Invalid("❗️ Iltimos, tugmalardan birini tanlang!")
+    return {'region_id': region_id}
+
+def parse_district(message: types.Message, data: dict) -> dict:
+    district_id = get_gazetteer().district_id(data.get('region_id'), message.text)
+    if not district_id:
+        raise flow.Invalid("❗️ Iltimos, tugmalardan birini tanlang!")
+    return {'district_id': district_id, 'district_name': message.text}
+
+# Date format DD.MM.YYYY
+parse_birth_date_format = flow.text(
+    'birth_date', pattern=r'^\d{2}\.\d{2}\.\d{4}$',
+    error="❌ Noto'g'ri format! Iltimos, sanani DD.MM.YYYY formatida kiriting.\n(Masalan: 01.01.2000)"
+)
 
-@bot.message_handler(state=RegistrationStates.confirmation)
-async def process_confirmation(message: types.Message):
+def parse_birth_date(message: types.Message, data: dict) -> dict:
+    fields = parse_birth_date_format(message, data)
+    # Validate if it's a real date
+    try:
+        day, month, year = fields['birth_date'].split('.')
+        datetime(int(year), int(month), int(day))
+    except ValueError:
+        raise flow.Invalid("❌ Noto'g'ri sana! Iltimos, mavjud sanani kiriting.\n(Masalan: 01.01.2000)")
+    return fields
+
+def parse_phone(message: types.Message, data: dict) -> dict:
+    if message.content_type == 'contact':
+        return {'phone_number': message.contact.phone_number}
+    return {'phone_number': message.text}
+
+def parse_project_type(message: types.Message, data: dict) -> dict:
+    selected_type = PROJECT_TYPE_KEYS.get(message.text)
+    if not selected_type:
+        logger.warning(f"User {message.from_user.id} selected invalid project type: '{message.text}'")
+        raise flow.Invalid("❗️ Iltimos, tugmalardan birini tanlang!")
+    logger.info(f"User {message.from_user.id} selected project type: {selected_type}")
+    return {'project_type': selected_type}
+
+def project_file_prompt(data: dict) -> str:
+    file_types = config.PROJECT_TYPES[data['project_type']]['file_types']
+    return (f"📎 Loyihangizni yuklang:\n\n"
+            f"Qo'llab-quvvatlanadigan formatlar: {file_types}\n\n"
+            f"Faylni shu yerga yuboring.")
+
+def remove_keyboard(data: dict) -> str:
+    return keyboards.remove()
+
+REGISTRATION_STEPS = [
+    flow.Step(
+        RegistrationStates.full_name,
+        "📝 Iltimos, to'liq ismingizni kiriting:\n(Masalan: Aliyev Vali Akramovich)",
+        parse=flow.text('full_name'), markup=remove_keyboard,
+        edit_prompt="📝 Yangi ismingizni kiriting:",
+        next=RegistrationStates.region, returns_on_edit=True
+    ),
+    flow.Step(
+        RegistrationStates.region,
+        "📍 Viloyatingizni tanlang:",
+        parse=parse_region, markup=lambda data: keyboards.regions(),
+        next=RegistrationStates.district
+    ),
+    flow.Step(
+        RegistrationStates.district,
+        "🏘 Tumaningizni tanlang:",
+        parse=parse_district, markup=lambda data: keyboards.districts(data['region_id']),
+        next=RegistrationStates.mahalla
+    ),
+    flow.Step(
+        RegistrationStates.mahalla,
+        "� Mahalla nomini kiriting:\n(Masalan: Yangi hayot mahallasi)",
+        parse=flow.text('mahalla'), markup=remove_keyboard,
+        next=RegistrationStates.workplace, returns_on_edit=True
+    ),
+    flow.Step(
+        RegistrationStates.workplace,
+        "🏢 Ish joyingizni kiriting:\n(Masalan: Toshkent davlat universiteti)",
+        parse=flow.text('workplace'), markup=remove_keyboard,
+        edit_prompt="🏢 Yangi ish joyingizni kiriting:",
+        next=RegistrationStates.birth_date, returns_on_edit=True
+    ),
+    flow.Step(
+        RegistrationStates.birth_date,
+        "📅 Tug'ilgan sanangizni kiriting:\n(Masalan: 01.01.2000)",
+        parse=parse_birth_date, markup=remove_keyboard,
+        edit_prompt="📅 Yangi tug'ilgan sanangizni kiriting (DD.MM.YYYY):",
+        next=RegistrationStates.passport_series, returns_on_edit=True
+    ),
+    flow.Step(
+        RegistrationStates.passport_series,
+        "🆔 Pasport seriya va raqamingizni kiriting:\n(Masalan: AA1234567)",
+        # 2 letters (any case) + 7 digits, stored in uppercase
+        parse=flow.text(
+            'passport_series', pattern=r'^[A-Za-z]{2}\d{7}$', normalise=str.upper,
+            error="❌ Noto'g'ri format! Pasport seriyasi 2 ta harf va 7 ta raqamdan iborat bo'lishi kerak.\n(Masalan: AA1234567)"
+        ),
+        markup=remove_keyboard,
+        edit_prompt="🆔 Yangi pasport ma'lumotingizni kiriting (AA1234567):",
+        next=RegistrationStates.phone_number, returns_on_edit=True
+    ),
+    flow.Step(
+        RegistrationStates.phone_number,
+        "📱 Telefon raqamingizni yuboring:",
+        parse=parse_phone, markup=lambda data: keyboards.phone_request(),
+        edit_prompt="📱 Yangi telefon raqamingizni yuboring:",
+        content_types=('contact', 'text')
+    ),
+    flow.Step(
+        RegistrationStates.project_type,
+        "🎨 Loyiha turini tanlang:",
+        parse=parse_project_type, markup=lambda data: keyboards.project_types(),
+        next=RegistrationStates.project_file
+    ),
+    # Answered by process_project_file
+    flow.Step(RegistrationStates.project_file, project_file_prompt, markup=remove_keyboard),
+]
+
+registration_flow = flow.Flow(bot, REGISTRATION_STEPS, on_complete=show_confirmation, completed_field='phone_number')
+registration_flow.register(router)
+
+# Confirmation screen buttons that jump back to a single step
+EDIT_STEPS = {
+    "👤 Ism": RegistrationStates.full_name,
+    "📍 Manzil": RegistrationStates.region,
+    "🏢 Ish joyi": RegistrationStates.workplace,
+    "📅 Tug'ilgan sana": RegistrationStates.birth_date,
+    "🆔 Pasport": RegistrationStates.passport_series,
+    "📱 Telefon": RegistrationStates.phone_number,
+}
+
+@router.step(RegistrationStates.confirmation, pass_state=True)
+async def process_confirmation(message: types.Message, state: str, data: dict):
     """Process confirmation response"""
     user_id = message.from_user.id
     logger.info(f"Confirmation handler received: '{message.text}' from user {user_id}")
     
     if message.text == "✅ Ha, to'g'ri":
-        # Check if user already exists (editing existing data)
-        db = SessionLocal()
-        try:
-            existing_user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
+        # Check if user already exists (editing existing data); new participants skip the database here
+        registration = await user_cache.get_registration(message.from_user.id)
+        if registration.registered:
+            logger.info(f"Updating existing user data for user {user_id}")
+            
+            # Update user and address in one transaction
+            db = AsyncSessionLocal()
+            try:
+                entry, changes = await registrations.save_participant(db, message.from_user.id, data)
+                await stats.apply(db, changes)
+                await db.commit()
+            finally:
+                await db.close()
+            await user_cache.remember(entry)
+            logger.info(f"User {user_id} data updated successfully")
+            
+            # Show success and options
+            markup = keyboards.after_update()
             
-            if existing_user:
-                logger.info(f"Updating existing user data for user {user_id}")
-                # Update existing user data
-                async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-                    # Update address
-                    address = db.query(Address).filter(Address.id == existing_user.address_id).first()
-                    if address:
-                        address.region_id = int(data['region_id'])
-                        address.district_id = int(data['district_id'])
-                        address.neighborhood = data.get('mahalla', '')
-                    
-                    # Update user
-                    existing_user.full_name = data['full_name']
-                    existing_user.workplace = data['workplace']
-                    existing_user.birth_date = data['birth_date']
-                    existing_user.passport_series = data['passport_series']
-                    existing_user.phone_number = data['phone_number']
-                    
-                    db.commit()
-                    logger.info(f"User {user_id} data updated successfully")
-                    
-                    # Show success and options
-                    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-                    markup.add(
-                        types.KeyboardButton("➕ Loyiha yuborish"),
-                        types.KeyboardButton("🏠 Bosh sahifa")
-                    )
-                    
-                    await bot.send_message(
-                        message.from_user.id,
-                        "✅ Ma'lumotlaringiz muvaffaqiyatli yangilandi!",
-                        reply_markup=markup
-                    )
-                    
-                    # Clear state
-                    await bot.delete_state(message.from_user.id, message.chat.id)
-                    return
-                    
-        finally:
-            db.close()
+            await bot.send_message(
+                message.from_user.id,
+                "✅ Ma'lumotlaringiz muvaffaqiyatli yangilandi!",
+                reply_markup=markup
+            )
+            
+            # Clear state
+            await bot.delete_state(message.from_user.id, message.chat.id)
+            return
         
         # If user doesn't exist, continue to project submission
-        # Ask for project type
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        for project_key, project_info in config.PROJECT_TYPES.items():
-            markup.add(types.KeyboardButton(project_info['title']))
-        
-        await bot.send_message(
-            message.from_user.id,
-            "🎨 Loyiha turini tanlang:",
-            reply_markup=markup
-        )
-        await bot.set_state(message.from_user.id, RegistrationStates.project_type, message.chat.id)
+        await registration_flow.enter(message, registration_flow.step(RegistrationStates.project_type), data)
     
     elif message.text == "✏️ Tahrirlash":
         # Show edit options
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        markup.add(
-            types.KeyboardButton("👤 Ism"),
-            types.KeyboardButton("📍 Manzil"),
-            types.KeyboardButton("🏢 Ish joyi"),
-            types.KeyboardButton("📅 Tug'ilgan sana"),
-            types.KeyboardButton("🆔 Pasport"),
-            types.KeyboardButton("📱 Telefon"),
-            types.KeyboardButton("🔙 Orqaga")
-        )
+        markup = keyboards.edit_options()
         
         await bot.send_message(
             message.from_user.id,
@@ -608,67 +452,10 @@ async def process_confirmation(message: types.Message):
         # Stay in confirmation state to handle edit buttons
     
     elif message.text == "🔙 Orqaga":
-        await show_confirmation(message)
-    
-    elif message.text == "👤 Ism":
-        markup = types.ReplyKeyboardRemove()
-        await bot.send_message(
-            message.from_user.id,
-            "📝 Yangi ismingizni kiriting:",
-            reply_markup=markup
-        )
-        await bot.set_state(message.from_user.id, RegistrationStates.full_name, message.chat.id)
-    
-    elif message.text == "📍 Manzil":
-        regions = load_regions()
-        region_markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        for region_id, region_data in regions.items():
-            region_markup.add(types.KeyboardButton(region_data['name']))
-        
-        await bot.send_message(
-            message.from_user.id,
-            "📍 Viloyatingizni tanlang:",
-            reply_markup=region_markup
-        )
-        await bot.set_state(message.from_user.id, RegistrationStates.region, message.chat.id)
-    
-    elif message.text == "🏢 Ish joyi":
-        markup = types.ReplyKeyboardRemove()
-        await bot.send_message(
-            message.from_user.id,
-            "🏢 Yangi ish joyingizni kiriting:",
-            reply_markup=markup
-        )
-        await bot.set_state(message.from_user.id, RegistrationStates.workplace, message.chat.id)
-    
-    elif message.text == "📅 Tug'ilgan sana":
-        markup = types.ReplyKeyboardRemove()
-        await bot.send_message(
-            message.from_user.id,
-            "📅 Yangi tug'ilgan sanangizni kiriting (DD.MM.YYYY):",
-            reply_markup=markup
-        )
-        await bot.set_state(message.from_user.id, RegistrationStates.birth_date, message.chat.id)
-    
-    elif message.text == "🆔 Pasport":
-        markup = types.ReplyKeyboardRemove()
-        await bot.send_message(
-            message.from_user.id,
-            "🆔 Yangi pasport ma'lumotingizni kiriting (AA1234567):",
-            reply_markup=markup
-        )
-        await bot.set_state(message.from_user.id, RegistrationStates.passport_series, message.chat.id)
+        await show_confirmation(message, data)
     
-    elif message.text == "📱 Telefon":
-        phone_markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        phone_markup.add(types.KeyboardButton("📱 Telefon raqamni yuborish", request_contact=True))
-        
-        await bot.send_message(
-            message.from_user.id,
-            "📱 Yangi telefon raqamingizni yuboring:",
-            reply_markup=phone_markup
-        )
-        await bot.set_state(message.from_user.id, RegistrationStates.phone_number, message.chat.id)
+    elif message.text in EDIT_STEPS:
+        await registration_flow.enter(message, registration_flow.step(EDIT_STEPS[message.text]), data)
     
     else:
         await bot.send_message(
@@ -676,264 +463,135 @@ async def process_confirmation(message: types.Message):
             "❗️ Iltimos, tugmalardan birini tanlang!"
         )
 
-@bot.message_handler(state=RegistrationStates.project_type)
-async def process_project_type(message: types.Message):
-    """Process project type selection"""
-    user_id = message.from_user.id
-    logger.info(f"Processing project type selection from user {user_id}: '{message.text}'")
-    
-    # Find selected project type
-    selected_type = None
-    for project_key, project_info in config.PROJECT_TYPES.items():
-        if project_info['title'] == message.text:
-            selected_type = project_key
-            break
-    
-    if not selected_type:
-        logger.warning(f"User {user_id} selected invalid project type: '{message.text}'")
-        await bot.send_message(message.from_user.id, "❗️ Iltimos, tugmalardan birini tanlang!")
-        return
-    
-    logger.info(f"User {user_id} selected project type: {selected_type}")
-    
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        data['project_type'] = selected_type
-    
-    # Ask for project file
-    markup = types.ReplyKeyboardRemove()
-    file_types = config.PROJECT_TYPES[selected_type]['file_types']
-    await bot.send_message(
-        message.from_user.id,
-        f"📎 Loyihangizni yuklang:\n\n"
-        f"Qo'llab-quvvatlanadigan formatlar: {file_types}\n\n"
-        f"Faylni shu yerga yuboring.",
-        reply_markup=markup
-    )
-    
-    # Set state to project_file
-    await bot.set_state(message.from_user.id, RegistrationStates.project_file, message.chat.id)
-    
-    # Verify state was set
-    current_state = await bot.get_state(message.from_user.id, message.chat.id)
-    logger.info(f"State set for user {user_id}: '{current_state}' (expected: '{RegistrationStates.project_file.name}')")
-
-@bot.message_handler(state=RegistrationStates.project_file, content_types=['document', 'photo', 'audio', 'video', 'voice'])
-async def process_project_file(message: types.Message):
+@router.step(RegistrationStates.project_file, content_types=['document', 'photo', 'audio', 'video', 'voice'],
+             pass_state=True)
+async def process_project_file(message: types.Message, state: str, details: dict):
     """Process project file submission"""
     user_id = message.from_user.id
     content_type = message.content_type
     logger.info(f"Received project file ({content_type}) from user {user_id}")
     
-    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        project_type = data.get('project_type')
-        
-        # Save to database first
-        db = SessionLocal()
-        try:
-            # Check if user exists, if not create new user
-            user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-            
-            if not user:
-                # Create address
-                address = Address(
-                    region_id=int(data['region_id']),
-                    district_id=int(data['district_id']),
-                    neighborhood=data.get('mahalla', '')
-                )
-                db.add(address)
-                db.flush()
-                
-                # Create user
-                user = User(
-                    telegram_id=message.from_user.id,
-                    full_name=data['full_name'],
-                    address_id=address.id,
-                    workplace=data['workplace'],
-                    birth_date=data['birth_date'],
-                    passport_series=data['passport_series'],
-                    phone_number=data['phone_number']
-                )
-                db.add(user)
-                db.flush()
-            
-            # Load user's address from database
-            address = db.query(Address).filter(Address.id == user.address_id).first()
-            
-            # Forward the project file to the channel
-            try:
-                # Forward the file to channel
-                forwarded_msg = await bot.forward_message(
-                    chat_id=config.CHANNEL_ID,
-                    from_chat_id=message.chat.id,
-                    message_id=message.message_id
-                )
-                
-                # Prepare user data message from database
-                regions = load_regions()
-                region_name = "N/A"
-                district_name = "N/A"
-                mahalla = "N/A"
-                
-                if address:
-                    region_name = regions.get(str(address.region_id), {}).get('name', 'N/A')
-                    districts = regions.get(str(address.region_id), {}).get('districts', {})
-                    district_name = districts.get(str(address.district_id), {}).get('name', 'N/A')
-                    mahalla = address.neighborhood or "N/A"
-                
-                project_type_title = config.PROJECT_TYPES.get(project_type, {}).get('title', 'N/A')
-                
-                user_data_text = f"""
-📋 <b>Ishtirokchi ma'lumotlari:</b>
-
-👤 <b>Ism:</b> {user.full_name or 'N/A'}
-📍 <b>Viloyat:</b> {region_name}
-🏘 <b>Tuman:</b> {district_name}
-🏘 <b>Mahalla:</b> {mahalla}
-🏢 <b>Ish joyi:</b> {user.workplace or 'N/A'}
-📅 <b>Tug'ilgan sana:</b> {user.birth_date or 'N/A'}
-🆔 <b>Pasport:</b> {user.passport_series or 'N/A'}
-📱 <b>Telefon:</b> {user.phone_number or 'N/A'}
-🎨 <b>Loyiha turi:</b> {project_type_title}
-"""
-                
-                # Send user data as reply to the forwarded message
-                user_data_msg = await bot.send_message(
-                    chat_id=config.CHANNEL_ID,
-                    text=user_data_text,
-                    parse_mode='HTML',
-                    reply_to_message_id=forwarded_msg.message_id
-                )
-                
-                # Get the message URL (construct it from channel and message id)
-                # Format for private channels: https://t.me/c/{channel_id_without_-100}/{message_id}
-                # Convert channel ID: -1003119110887 -> 3119110887
-                channel_id_str = str(config.CHANNEL_ID)
-                if channel_id_str.startswith('-100'):
-                    channel_id_clean = channel_id_str[4:]  # Remove '-100' prefix
-                    project_url = f"https://t.me/c/{channel_id_clean}/{forwarded_msg.message_id}"
-                else:
-                    # For public channels with @ username
-                    channel_username = config.CHANNEL_ID.replace('@', '')
-                    project_url = f"https://t.me/{channel_username}/{forwarded_msg.message_id}"
-                
-                # Create project record
-                project = Project(
-                    user_id=user.id,
-                    type=project_type,
-                    project_url=project_url
-                )
-                db.add(project)
-                db.commit()
-                
-                logger.info(f"Project saved successfully for user {user_id}: type={project_type}, url={project_url}")
-                
-                # Success message with option to submit another project
-                markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-                markup.add(
-                    types.KeyboardButton("➕ Yana loyiha yuborish"),
-                    types.KeyboardButton("🏠 Bosh sahifa")
-                )
-                
-                await bot.send_message(
-                    message.from_user.id,
-                    "✅ Rahmat! Loyihangiz muvaffaqiyatli yuborildi.\n\n"
-                    "Sizning loyihangiz ko'rib chiqiladi va natijalar keyinroq e'lon qilinadi.",
-                    reply_markup=markup
-                )
-                
-            except Exception as e:
-                logger.error(f"Error forwarding to channel: {e}")
-                db.rollback()
+    project_type = details.get('project_type')
+    
+    # Snapshot of a participant written by this submission, for the cache
+    registration = None
+    
+    # Save to database first
+    db = AsyncSessionLocal()
+    try:
+        changes = stats.project_changes(project_type)
+        if 'full_name' in details:
+            # End of the registration flow: create the user (or update it if a concurrent submission already did)
+            registration, participant_changes = await registrations.save_participant(db, message.from_user.id, details)
+            changes.update(participant_changes)
+            participant = registration.user_id
+        else:
+            # "Submit another project": the participant must still exist when the project is written
+            participant = await registrations.participant_id(db, message.from_user.id)
+            if participant is None:
                 await bot.send_message(
                     message.from_user.id,
-                    "❌ Loyihani yuborishda xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
+                    "❌ Siz hali ro'yxatdan o'tmagansiz. Iltimos, avval ro'yxatdan o'ting."
                 )
+                await bot.delete_state(message.from_user.id, message.chat.id)
                 return
-                
-        except Exception as e:
-            logger.error(f"Error saving user data: {e}", exc_info=True)
-            db.rollback()
-            await bot.send_message(
-                message.from_user.id,
-                "❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
-            )
-        finally:
-            db.close()
+        
+        # Save the project as pending - the channel outbox forwards it after
+        # the commit, so no Telegram round-trip happens inside this transaction
+        project = Project(
+            user_id=participant,
+            type=project_type,
+            status=PROJECT_PENDING,
+            source_chat_id=message.chat.id,
+            source_message_id=message.message_id
+        )
+        db.add(project)
+        await stats.apply(db, changes)
+        await db.commit()
+        if registration is not None:
+            await user_cache.remember(registration)
+        
+        logger.info(f"Project {project.id} saved for user {user_id}: type={project_type}, queued for channel")
+        channel_outbox.notify()
+        
+        # Success message with option to submit another project
+        markup = keyboards.after_project()
+        
+        await bot.send_message(
+            message.from_user.id,
+            "✅ Rahmat! Loyihangiz muvaffaqiyatli yuborildi.\n\n"
+            "Sizning loyihangiz ko'rib chiqiladi va natijalar keyinroq e'lon qilinadi.",
+            reply_markup=markup
+        )
+            
+    except Exception as e:
+        logger.error(f"Error saving user data: {e}", exc_info=True)
+        await db.rollback()
+        await bot.send_message(
+            message.from_user.id,
+            "❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
+        )
+    finally:
+        await db.close()
     
     # Delete state
     await bot.delete_state(message.from_user.id, message.chat.id)
 
-@bot.message_handler(func=lambda message: message.text == "🏠 Bosh sahifa")
+@router.button("🏠 Bosh sahifa")
 async def go_home(message: types.Message):
     """Return to home page"""
     await welcome_handler(message)
 
-@bot.message_handler(func=lambda message: message.text in ["➕ Yana loyiha yuborish", "➕ Loyiha yuborish"])
+@router.button("➕ Yana loyiha yuborish", "➕ Loyiha yuborish")
 async def submit_another_project(message: types.Message):
     """Allow user to submit another project"""
     user_id = message.from_user.id
     logger.info(f"User {user_id} clicked submit project button: '{message.text}'")
     
     # Ask for project type
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    for project_key, project_info in config.PROJECT_TYPES.items():
-        markup.add(types.KeyboardButton(project_info['title']))
-    
-    await bot.send_message(
-        message.from_user.id,
-        "🎨 Loyiha turini tanlang:",
-        reply_markup=markup
-    )
-    await bot.set_state(message.from_user.id, RegistrationStates.project_type, message.chat.id)
+    await registration_flow.enter(message, registration_flow.step(RegistrationStates.project_type), {})
     logger.info(f"State set to project_type for user {user_id}")
 
-@bot.message_handler(func=lambda message: message.text == "✏️ Ma'lumotlarni tahrirlash")
+@router.button("✏️ Ma'lumotlarni tahrirlash")
 async def edit_personal_info(message: types.Message):
     """Allow user to edit their personal information"""
     # Check if user exists
-    db = SessionLocal()
     try:
-        user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-        if not user:
+        user = await user_cache.get_registration(message.from_user.id)
+        if not user.registered:
             await bot.send_message(
                 message.from_user.id,
                 "❌ Siz hali ro'yxatdan o'tmagansiz. Iltimos, avval ro'yxatdan o'ting."
             )
             return
         
-        # Get user's address
-        address = None
-        if user.address_id:
-            address = db.query(Address).filter(Address.id == user.address_id).first()
-        
-        # Set state first to initialize storage
-        await bot.set_state(message.from_user.id, RegistrationStates.confirmation, message.chat.id)
-        
-        # Load user data into state
-        async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-            data['full_name'] = user.full_name or ''
-            data['region_id'] = str(address.region_id) if address and address.region_id else '1'
-            data['district_id'] = str(address.district_id) if address and address.district_id else '1'
-            data['mahalla'] = address.neighborhood if address and address.neighborhood else ''
-            data['workplace'] = user.workplace or ''
-            data['birth_date'] = user.birth_date or ''
-            data['passport_series'] = user.passport_series or ''
-            data['phone_number'] = user.phone_number or ''
-            
-            # Get district name for confirmation display
-            if address and address.region_id and address.district_id:
-                try:
-                    regions = load_regions()
-                    districts = regions.get(str(address.region_id), {}).get('districts', {})
-                    data['district_name'] = districts.get(str(address.district_id), {}).get('name', 'N/A')
-                except Exception as e:
-                    logger.error(f"Error loading district name: {e}")
-                    data['district_name'] = 'N/A'
-            else:
+        # User's address is part of the cached registration
+        address = user.address
+        
+        # Load user data into the form
+        data = {
+            'full_name': user.full_name or '',
+            'region_id': str(address.region_id) if address and address.region_id else '1',
+            'district_id': str(address.district_id) if address and address.district_id else '1',
+            'mahalla': address.neighborhood if address and address.neighborhood else '',
+            'workplace': user.workplace or '',
+            'birth_date': user.birth_date or '',
+            'passport_series': user.passport_series or '',
+            'phone_number': user.phone_number or '',
+        }
+        
+        # Get district name for confirmation display
+        if address and address.region_id and address.district_id:
+            try:
+                data['district_name'] = get_gazetteer().district_name(address.region_id, address.district_id)
+            except Exception as e:
+                logger.error(f"Error loading district name: {e}")
                 data['district_name'] = 'N/A'
+        else:
+            data['district_name'] = 'N/A'
         
-        # Show confirmation screen
-        await show_confirmation(message)
+        # Show confirmation screen (stores the form and the confirmation state in one write)
+        await show_confirmation(message, data)
         
     except Exception as e:
         logger.error(f"Error in edit_personal_info: {e}", exc_info=True)
@@ -941,48 +599,74 @@ async def edit_personal_info(message: types.Message):
             message.from_user.id,
             "❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
         )
-    finally:
-        db.close()
 
-# Handle contact sharing separately
-@bot.message_handler(content_types=['contact'])
+# Contact shared outside the phone number step
+@router.fallback('contact')
 async def handle_contact(message: types.Message):
-    """Handle contact sharing"""
-    current_state = await bot.get_state(message.from_user.id, message.chat.id)
-    logger.info(f"Contact received from user {message.from_user.id} in state {current_state}")
-    
-    if current_state == RegistrationStates.phone_number.name:
-        await process_phone(message)
-    else:
-        await bot.send_message(
-            message.from_user.id,
-            "❌ Kutilmagan harakat. Iltimos, /start dan boshlang."
-        )
+    """Handle unexpected contact sharing"""
+    logger.info(f"Unexpected contact received from user {message.from_user.id}")
+    await bot.send_message(
+        message.from_user.id,
+        "❌ Kutilmagan harakat. Iltimos, /start dan boshlang."
+    )
 
-# Handle file uploads separately
-@bot.message_handler(content_types=['document', 'photo', 'audio', 'video', 'voice'])
+# File sent outside the project file step
+@router.fallback('document', 'photo', 'audio', 'video', 'voice')
 async def handle_file_upload(message: types.Message):
-    """Handle file uploads"""
-    current_state = await bot.get_state(message.from_user.id, message.chat.id)
-    logger.info(f"File received from user {message.from_user.id} in state '{current_state}', content_type: {message.content_type}")
-    logger.info(f"Expected state: '{RegistrationStates.project_file.name}'")
-    logger.info(f"State match: {current_state == RegistrationStates.project_file.name}")
+    """Handle unexpected file uploads"""
+    logger.warning(f"User {message.from_user.id} sent {message.content_type} without being in project_file state")
+    await bot.send_message(
+        message.from_user.id,
+        f"❌ Iltimos, avval loyiha turini tanlang.\n\n"
+        f"Qadam:\n"
+        f"1️⃣ \"➕ Loyiha yuborish\" tugmasini bosing\n"
+        f"2️⃣ Loyiha turini tanlang\n"
+        f"3️⃣ Faylni yuboring"
+    )
+
+# Running admin exports, referenced until they finish so they are not garbage collected
+_export_tasks = set()
+
+def _export_finished(task: asyncio.Task):
+    _export_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Admin export task failed: {task.exception()!r}")
+
+def start_admin_export(message: types.Message, window: ExportWindow = None):
+    """Start an export in the background; the handler (and its update worker) returns right away"""
+    task = asyncio.create_task(run_admin_export(message, window))
+    _export_tasks.add(task)
+    task.add_done_callback(_export_finished)
+
+async def run_admin_export(message: types.Message, window: ExportWindow = None):
+    """Build (or reuse) an export and send it to the admin"""
+    user_id = message.from_user.id
+    status_message = await bot.send_message(
+        message.from_user.id,
+        "⏳ Ma'lumotlar tayyorlanmoqda, iltimos kuting..."
+    )
     
-    if current_state == RegistrationStates.project_file.name:
-        logger.info(f"Routing to process_project_file for user {message.from_user.id}")
-        await process_project_file(message)
-    else:
-        logger.warning(f"User {message.from_user.id} sent file without being in project_file state. Current state: {current_state}")
+    try:
+        stamp = await data_version()
+        result = await export_jobs.get_export(
+            stamp,
+            watcher=(message.from_user.id, status_message.message_id),
+            window=window
+        )
+        await export_jobs.send(message.from_user.id, result)
+        await save_watermark(user_id, stamp)
+        
+        logger.info(f"Admin {user_id} exported data successfully: {result.users} users, {result.projects} projects"
+                    f"{' (incremental)' if window else ''}")
+        
+    except Exception as e:
+        logger.error(f"Error exporting data: {e}", exc_info=True)
         await bot.send_message(
             message.from_user.id,
-            f"❌ Iltimos, avval loyiha turini tanlang.\n\n"
-            f"Qadam:\n"
-            f"1️⃣ \"➕ Loyiha yuborish\" tugmasini bosing\n"
-            f"2️⃣ Loyiha turini tanlang\n"
-            f"3️⃣ Faylni yuboring"
+            "❌ Ma'lumotlarni yuklashda xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
         )
 
-@bot.message_handler(func=lambda message: message.text == "📊 Ma'lumotlarni yuklab olish (Admin)")
+@router.button("📊 Ma'lumotlarni yuklab olish (Admin)")
 async def export_data_admin(message: types.Message):
     """Export all data to Excel (Admin only)"""
     user_id = message.from_user.id
@@ -996,361 +680,102 @@ async def export_data_admin(message: types.Message):
         return
     
     logger.info(f"Admin {user_id} initiated data export")
-    await bot.send_message(
-        message.from_user.id,
-        "⏳ Ma'lumotlar tayyorlanmoqda, iltimos kuting..."
-    )
+    start_admin_export(message)
+
+@router.button("🆕 Yangi ma'lumotlar (Admin)")
+async def export_new_data_admin(message: types.Message):
+    """Export only data added since the admin's last export (Admin only)"""
+    user_id = message.from_user.id
+    if user_id not in config.ADMIN_IDS:
+        logger.warning(f"Non-admin user {user_id} attempted to access admin export function")
+        await bot.send_message(
+            message.from_user.id,
+            "❌ Bu funksiya faqat adminlar uchun!"
+        )
+        return
     
-    db = SessionLocal()
-    try:
-        # Create workbook
-        wb = Workbook()
-        
-        # Sheet 1: All Users with their data
-        ws_users = wb.active
-        ws_users.title = "Foydalanuvchilar"
-        
-        # Header styling - Enhanced colors
-        header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")  # Dark blue
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        
-        # Data styling
-        even_row_fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")  # Light gray
-        data_font = Font(size=11)
-        
-        # Border styling
-        thin_border = Border(
-            left=Side(style='thin', color='D3D3D3'),
-            right=Side(style='thin', color='D3D3D3'),
-            top=Side(style='thin', color='D3D3D3'),
-            bottom=Side(style='thin', color='D3D3D3')
+    window = await get_watermark(user_id)
+    if window is None:
+        logger.info(f"Admin {user_id} has no previous export, running full export")
+    else:
+        logger.info(f"Admin {user_id} initiated incremental export: {window}")
+    start_admin_export(message, window)
+
+@router.command('export_since')
+async def export_since_admin(message: types.Message):
+    """Export data after an explicit watermark: /export_since DD.MM.YYYY or /export_since <ID> (Admin only)"""
+    user_id = message.from_user.id
+    if user_id not in config.ADMIN_IDS:
+        logger.warning(f"Non-admin user {user_id} attempted to access admin export function")
+        await bot.send_message(
+            message.from_user.id,
+            "❌ Bu buyruq faqat adminlar uchun!"
         )
-        
-        # Headers for users sheet
-        headers = [
-            "№", "Telegram ID", "To'liq ism", "Viloyat", "Tuman", "Mahalla",
-            "Ish joyi", "Tug'ilgan sana", "Pasport", "Telefon", "Loyihalar soni"
-        ]
-        
-        for col_num, header in enumerate(headers, 1):
-            cell = ws_users.cell(row=1, column=col_num)
-            cell.value = header
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.border = thin_border
-        
-        # Load regions for display
-        regions = load_regions()
-        
-        # Fetch all users with their addresses
-        users = db.query(User).all()
-        
-        for idx, user in enumerate(users, 2):
-            address = db.query(Address).filter(Address.id == user.address_id).first()
-            
-            # Get region and district names
-            region_name = "N/A"
-            district_name = "N/A"
-            mahalla = "N/A"
-            
-            if address:
-                region_name = regions.get(str(address.region_id), {}).get('name', 'N/A')
-                districts = regions.get(str(address.region_id), {}).get('districts', {})
-                district_name = districts.get(str(address.district_id), {}).get('name', 'N/A')
-                mahalla = address.neighborhood or "N/A"
-            
-            # Count projects
-            project_count = db.query(Project).filter(Project.user_id == user.id).count()
-            
-            # Write user data
-            ws_users.cell(row=idx, column=1).value = idx - 1
-            ws_users.cell(row=idx, column=2).value = user.telegram_id
-            ws_users.cell(row=idx, column=3).value = user.full_name or "N/A"
-            ws_users.cell(row=idx, column=4).value = region_name
-            ws_users.cell(row=idx, column=5).value = district_name
-            ws_users.cell(row=idx, column=6).value = mahalla
-            ws_users.cell(row=idx, column=7).value = user.workplace or "N/A"
-            ws_users.cell(row=idx, column=8).value = user.birth_date or "N/A"
-            ws_users.cell(row=idx, column=9).value = user.passport_series or "N/A"
-            ws_users.cell(row=idx, column=10).value = user.phone_number or "N/A"
-            ws_users.cell(row=idx, column=11).value = project_count
-            
-            # Apply styling to all cells in row
-            for col in range(1, 12):
-                cell = ws_users.cell(row=idx, column=col)
-                cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                cell.font = data_font
-                cell.border = thin_border
-                # Alternate row colors for better readability
-                if idx % 2 == 0:
-                    cell.fill = even_row_fill
-        
-        # Set specific column widths for better layout
-        ws_users.column_dimensions['A'].width = 6   # №
-        ws_users.column_dimensions['B'].width = 14  # Telegram ID
-        ws_users.column_dimensions['C'].width = 30  # Full name
-        ws_users.column_dimensions['D'].width = 20  # Region
-        ws_users.column_dimensions['E'].width = 20  # District
-        ws_users.column_dimensions['F'].width = 25  # Mahalla
-        ws_users.column_dimensions['G'].width = 30  # Workplace
-        ws_users.column_dimensions['H'].width = 15  # Birth date
-        ws_users.column_dimensions['I'].width = 15  # Passport
-        ws_users.column_dimensions['J'].width = 16  # Phone
-        ws_users.column_dimensions['K'].width = 12  # Projects count
-        
-        # Freeze the header row
-        ws_users.freeze_panes = 'A2'
-        
-        # Sheet 2: All Projects
-        ws_projects = wb.create_sheet("Loyihalar")
-        
-        # Headers for projects sheet
-        project_headers = [
-            "№", "Ishtirokchi", "Telegram ID", "Loyiha turi", "Loyiha URL",
-            "Viloyat", "Tuman", "Telefon"
-        ]
-        
-        for col_num, header in enumerate(project_headers, 1):
-            cell = ws_projects.cell(row=1, column=col_num)
-            cell.value = header
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.border = thin_border
-        
-        # Fetch all projects
-        projects = db.query(Project).all()
-        
-        for idx, project in enumerate(projects, 2):
-            user = db.query(User).filter(User.id == project.user_id).first()
-            address = db.query(Address).filter(Address.id == user.address_id).first() if user else None
-            
-            # Get region and district names
-            region_name = "N/A"
-            district_name = "N/A"
-            
-            if address:
-                region_name = regions.get(str(address.region_id), {}).get('name', 'N/A')
-                districts = regions.get(str(address.region_id), {}).get('districts', {})
-                district_name = districts.get(str(address.district_id), {}).get('name', 'N/A')
-            
-            # Get project type title
-            project_type_title = config.PROJECT_TYPES.get(project.type, {}).get('title', project.type)
-            
-            # Write project data
-            ws_projects.cell(row=idx, column=1).value = idx - 1
-            ws_projects.cell(row=idx, column=2).value = user.full_name if user else "N/A"
-            ws_projects.cell(row=idx, column=3).value = user.telegram_id if user else "N/A"
-            ws_projects.cell(row=idx, column=4).value = project_type_title
-            
-            # Make URL clickable with hyperlink
-            url_cell = ws_projects.cell(row=idx, column=5)
-            if project.project_url:
-                url_cell.value = project.project_url
-                url_cell.hyperlink = project.project_url
-                url_cell.font = Font(color="0563C1", underline="single", size=11)  # Blue and underlined
-            else:
-                url_cell.value = "N/A"
-            
-            ws_projects.cell(row=idx, column=6).value = region_name
-            ws_projects.cell(row=idx, column=7).value = district_name
-            ws_projects.cell(row=idx, column=8).value = user.phone_number if user else "N/A"
-            
-            # Apply styling to all cells in row
-            for col in range(1, 9):
-                cell = ws_projects.cell(row=idx, column=col)
-                cell.border = thin_border
-                if col != 5:  # Don't center the URL
-                    cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                    cell.font = data_font
-                else:
-                    cell.alignment = Alignment(horizontal="left", vertical="center")
-                
-                # Alternate row colors
-                if idx % 2 == 0 and col != 5:  # Don't color the URL cell
-                    cell.fill = even_row_fill
-        
-        # Set specific column widths for projects sheet
-        ws_projects.column_dimensions['A'].width = 6   # №
-        ws_projects.column_dimensions['B'].width = 30  # Participant name
-        ws_projects.column_dimensions['C'].width = 14  # Telegram ID
-        ws_projects.column_dimensions['D'].width = 25  # Project type
-        ws_projects.column_dimensions['E'].width = 45  # Project URL (wider for links)
-        ws_projects.column_dimensions['F'].width = 20  # Region
-        ws_projects.column_dimensions['G'].width = 20  # District
-        ws_projects.column_dimensions['H'].width = 16  # Phone
-        
-        # Freeze the header row
-        ws_projects.freeze_panes = 'A2'
-        
-        # Sheet 3: Statistics
-        ws_stats = wb.create_sheet("Statistika")
-        
-        total_users = len(users)
-        total_projects = len(projects)
-        
-        # Count by regions
-        region_stats = {}
-        for user in users:
-            address = db.query(Address).filter(Address.id == user.address_id).first()
-            if address:
-                region_name = regions.get(str(address.region_id), {}).get('name', 'Noma\'lum')
-                region_stats[region_name] = region_stats.get(region_name, 0) + 1
-        
-        # Count by project types
-        project_type_stats = {}
-        for project in projects:
-            project_type_title = config.PROJECT_TYPES.get(project.type, {}).get('title', project.type)
-            project_type_stats[project_type_title] = project_type_stats.get(project_type_title, 0) + 1
-        
-        # Write statistics with enhanced styling
-        row = 1
-        
-        # Main title
-        title_cell = ws_stats.cell(row=row, column=1)
-        title_cell.value = "UMUMIY STATISTIKA"
-        title_cell.font = Font(bold=True, size=16, color="1F4E78")
-        title_cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-        ws_stats.merge_cells(f'A{row}:B{row}')
-        ws_stats.row_dimensions[row].height = 25
-        row += 2
-        
-        # Summary statistics
-        summary_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-        
-        label_cell = ws_stats.cell(row=row, column=1)
-        label_cell.value = "Jami ro'yxatdan o'tganlar:"
-        label_cell.font = Font(bold=True, size=12)
-        label_cell.fill = summary_fill
-        value_cell = ws_stats.cell(row=row, column=2)
-        value_cell.value = total_users
-        value_cell.font = Font(bold=True, size=12, color="C00000")
-        value_cell.fill = summary_fill
-        value_cell.alignment = Alignment(horizontal="center", vertical="center")
-        row += 1
-        
-        label_cell = ws_stats.cell(row=row, column=1)
-        label_cell.value = "Jami yuborilgan loyihalar:"
-        label_cell.font = Font(bold=True, size=12)
-        label_cell.fill = summary_fill
-        value_cell = ws_stats.cell(row=row, column=2)
-        value_cell.value = total_projects
-        value_cell.font = Font(bold=True, size=12, color="C00000")
-        value_cell.fill = summary_fill
-        value_cell.alignment = Alignment(horizontal="center", vertical="center")
-        row += 3
-        
-        # Region statistics
-        section_cell = ws_stats.cell(row=row, column=1)
-        section_cell.value = "VILOYATLAR BO'YICHA"
-        section_cell.font = Font(bold=True, size=13, color="FFFFFF")
-        section_cell.fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-        ws_stats.merge_cells(f'A{row}:B{row}')
-        ws_stats.row_dimensions[row].height = 20
-        row += 1
-        
-        # Region data with alternating colors
-        for idx_stat, (region_name, count) in enumerate(sorted(region_stats.items(), key=lambda x: x[1], reverse=True), 1):
-            name_cell = ws_stats.cell(row=row, column=1)
-            name_cell.value = region_name
-            name_cell.font = Font(size=11)
-            count_cell = ws_stats.cell(row=row, column=2)
-            count_cell.value = count
-            count_cell.font = Font(size=11, bold=True)
-            count_cell.alignment = Alignment(horizontal="center", vertical="center")
-            
-            if idx_stat % 2 == 0:
-                name_cell.fill = even_row_fill
-                count_cell.fill = even_row_fill
-            row += 1
-        
-        row += 2
-        
-        # Project type statistics
-        section_cell = ws_stats.cell(row=row, column=1)
-        section_cell.value = "LOYIHA TURLARI BO'YICHA"
-        section_cell.font = Font(bold=True, size=13, color="FFFFFF")
-        section_cell.fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-        ws_stats.merge_cells(f'A{row}:B{row}')
-        ws_stats.row_dimensions[row].height = 20
-        row += 1
-        
-        # Project type data with alternating colors
-        for idx_stat, (project_type, count) in enumerate(sorted(project_type_stats.items(), key=lambda x: x[1], reverse=True), 1):
-            name_cell = ws_stats.cell(row=row, column=1)
-            name_cell.value = project_type
-            name_cell.font = Font(size=11)
-            count_cell = ws_stats.cell(row=row, column=2)
-            count_cell.value = count
-            count_cell.font = Font(size=11, bold=True)
-            count_cell.alignment = Alignment(horizontal="center", vertical="center")
-            
-            if idx_stat % 2 == 0:
-                name_cell.fill = even_row_fill
-                count_cell.fill = even_row_fill
-            row += 1
-        
-        # Set column widths for stats sheet
-        ws_stats.column_dimensions['A'].width = 45
-        ws_stats.column_dimensions['B'].width = 18
-        
-        # Save to temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
-        temp_file.close()
-        
-        # Send file to admin
-        with open(temp_file.name, 'rb') as file:
-            await bot.send_document(
+        return
+    
+    argument = (message.text or "").split(maxsplit=1)[1:]
+    argument = argument[0].strip() if argument else ""
+    window = None
+    if argument.isdigit():
+        # Participants and projects with a larger ID
+        window = ExportWindow(user_id=int(argument), project_id=int(argument))
+    else:
+        try:
+            window = ExportWindow(since=datetime.strptime(argument, '%d.%m.%Y'))
+        except ValueError:
+            await bot.send_message(
                 message.from_user.id,
-                file,
-                caption=f"📊 <b>Tanlov ma'lumotlari</b>\n\n"
-                        f"👥 Jami ishtirokchilar: {total_users}\n"
-                        f"📁 Jami loyihalar: {total_projects}\n"
-                        f"📅 Sana: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-                parse_mode='HTML',
-                visible_file_name=f"Tanlov_malumotlari_{datetime.now().strftime('%d_%m_%Y')}.xlsx"
+                "❗️ Foydalanish:\n"
+                "/export_since 01.10.2025 - shu sanadan beri qo'shilgan yoki o'zgargan ma'lumotlar\n"
+                "/export_since 150 - ID si 150 dan katta bo'lgan ishtirokchilar va loyihalar"
             )
-        
-        # Delete temporary file
-        os.unlink(temp_file.name)
-        
-        logger.info(f"Admin {user_id} exported data successfully: {total_users} users, {total_projects} projects")
-        
-    except Exception as e:
-        logger.error(f"Error exporting data: {e}", exc_info=True)
+            return
+    
+    logger.info(f"Admin {user_id} initiated incremental export: {window}")
+    start_admin_export(message, window)
+
+@router.command('stats')
+async def stats_admin(message: types.Message):
+    """Show participant statistics from the pre-aggregated counters (Admin only)"""
+    user_id = message.from_user.id
+    if user_id not in config.ADMIN_IDS:
+        logger.warning(f"Non-admin user {user_id} attempted to access admin stats")
         await bot.send_message(
             message.from_user.id,
-            "❌ Ma'lumotlarni yuklashda xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
+            "❌ Bu buyruq faqat adminlar uchun!"
         )
-    finally:
-        db.close()
-
-# Debug: Catch-all handler to see unhandled messages
-@bot.message_handler(func=lambda message: True, content_types=['text'])
-async def debug_handler(message: types.Message):
-    """Catch-all handler to route unhandled messages"""
-    current_state = await bot.get_state(message.from_user.id, message.chat.id)
+        return
+    
+    async with AsyncSessionLocal() as db:
+        counters = await stats.get_stats(db)
+    
+    gazetteer = get_gazetteer()
+    unknown = "Noma'lum"
+    lines = [
+        "📊 <b>UMUMIY STATISTIKA</b>\n",
+        f"👥 Jami ro'yxatdan o'tganlar: <b>{counters[stats.USERS].get('', 0)}</b>",
+        f"📁 Jami yuborilgan loyihalar: <b>{counters[stats.PROJECTS].get('', 0)}</b>",
+        "\n📍 <b>Viloyatlar bo'yicha:</b>",
+    ]
+    regions = sorted(counters[stats.REGION].items(), key=lambda item: item[1], reverse=True)
+    for region_id, count in regions:
+        lines.append(f"• {gazetteer.region_name(region_id, unknown)}: {count}")
+        districts = [
+            (key.split(':', 1)[1], district_count)
+            for key, district_count in counters[stats.DISTRICT].items()
+            if key.split(':', 1)[0] == region_id
+        ]
+        for district_id, district_count in sorted(districts, key=lambda item: item[1], reverse=True):
+            lines.append(f"    ◦ {gazetteer.district_name(region_id, district_id)}: {district_count}")
+    
+    lines.append("\n🎨 <b>Loyiha turlari bo'yicha:</b>")
+    for project_type, count in sorted(counters[stats.PROJECT_TYPE].items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"• {config.PROJECT_TYPES.get(project_type, {}).get('title', project_type or 'N/A')}: {count}")
     
-    # Route to correct handler based on state
-    if current_state == RegistrationStates.full_name.name:
-        await process_full_name(message)
-    elif current_state == RegistrationStates.region.name:
-        await process_region(message)
-    elif current_state == RegistrationStates.district.name:
-        await process_district(message)
-    elif current_state == RegistrationStates.mahalla.name:
-        await process_mahalla(message)
-    elif current_state == RegistrationStates.workplace.name:
-        await process_workplace(message)
-    elif current_state == RegistrationStates.birth_date.name:
-        await process_birth_date(message)
-    elif current_state == RegistrationStates.passport_series.name:
-        await process_passport(message)
-    elif current_state == RegistrationStates.phone_number.name:
-        await process_phone(message)
-    elif current_state == RegistrationStates.confirmation.name:
-        await process_confirmation(message)
-    elif current_state == RegistrationStates.project_type.name:
-        await process_project_type(message)
+    # Per-district lines can exceed Telegram's message length limit
+    for text in util.smart_split("\n".join(lines)):
+        await bot.send_message(message.from_user.id, text, parse_mode='HTML')
+
+# Time every handler registered above and route messages to them
+metrics.time_handlers(router.handlers)
+router.install()
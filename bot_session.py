@@ -0,0 +1,84 @@
+"""
+Long-lived HTTP session for Telegram Bot API calls.
+
+pyTelegramBotAPI keeps a module-level session manager in
+``telebot.asyncio_helper``; this module replaces it with one that owns a
+single keep-alive ``aiohttp`` session per process (tuned connection limit,
+DNS cache, TLS context reused across connections) and closes it explicitly
+at shutdown instead of leaving it to the garbage collector.
+"""
+import asyncio
+import logging
+import ssl
+
+import aiohttp
+import certifi
+from telebot import asyncio_helper
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSessionManager:
+    """Drop-in replacement for ``asyncio_helper.SessionManager``"""
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 60, dns_ttl: int = 300):
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self.session = None
+        self._loop = None
+
+    async def create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_ttl,
+            ssl=self.ssl_context,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+        self._loop = asyncio.get_running_loop()
+        logger.info(f"Bot API session opened (limit={self.limit}, keepalive={self.keepalive_timeout}s)")
+        return self.session
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        # No awaits between the check and create_session(), so concurrent
+        # callers on one loop always share a single session
+        loop = asyncio.get_running_loop()
+        if self.session is not None and not self.session.closed:
+            if self._loop is loop:
+                return self.session
+            # Connections belong to another event loop (e.g. a startup helper loop)
+            logger.warning("Bot API session was created on another event loop, reopening it")
+            if self._loop is not None and self._loop.is_running():
+                asyncio.run_coroutine_threadsafe(self.session.close(), self._loop)
+        return await self.create_session()
+
+    async def close(self):
+        """Close the session and its pooled connections"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("Bot API session closed")
+        self.session = None
+
+
+def install() -> PooledSessionManager:
+    """Make every Bot API request in this process go through the pooled session"""
+    if not isinstance(asyncio_helper.session_manager, PooledSessionManager):
+        asyncio_helper.session_manager = PooledSessionManager(
+            limit=config.BOT_API_CONNECTIONS,
+            keepalive_timeout=config.BOT_API_KEEPALIVE,
+        )
+    return asyncio_helper.session_manager
+
+
+async def close():
+    """Close the pooled session (called from the shutdown phase)"""
+    manager = asyncio_helper.session_manager
+    if isinstance(manager, PooledSessionManager):
+        await manager.close()
+    elif manager.session is not None:
+        await manager.session.close()
@@ -0,0 +1,226 @@
+"""
+Transactional outbox for forwarding projects to the channel.
+
+``process_project_file`` only commits the project with status 'pending'
+(and the source message it came from). This dispatcher then claims pending
+projects, forwards them to ``config.CHANNEL_ID`` with the participant card
+as a reply, and stores the resulting ``project_url``. Failures are retried
+with backoff, so Telegram errors never roll back a registration and no
+database connection is held across a Bot API round-trip.
+
+Every worker process runs a dispatcher; a project is claimed with a single
+conditional UPDATE, so only one of them sends it. A claim expires after
+``CLAIM_TIMEOUT`` seconds, which lets another process pick up projects whose
+sender died mid-way. While the Bot API calls run (the send scheduler may wait
+out flood limits and retry for longer than that), the sender renews its claim
+every ``CLAIM_RENEW_INTERVAL`` seconds.
+
+Delivery is at-least-once: if a sender dies, or cannot renew its claim, after
+Telegram accepted a message but before the result was stored, the project is
+sent again and the channel gets a duplicate post or participant card.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, or_, and_
+from sqlalchemy.orm import joinedload
+
+import config
+from database import AsyncSessionLocal
+from gazetteer import get_gazetteer
+from models.User import User
+from models.Project import Project, PROJECT_PENDING, PROJECT_SENDING, PROJECT_SENT, PROJECT_FAILED
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed project may stay in 'sending' before another worker may take it over
+CLAIM_TIMEOUT = 300
+
+# Seconds between claim renewals of a project that is being sent
+CLAIM_RENEW_INTERVAL = CLAIM_TIMEOUT / 3
+
+
+def project_url(channel_message_id: int) -> str:
+    """Link to a message in config.CHANNEL_ID"""
+    # Format for private channels: https://t.me/c/{channel_id_without_-100}/{message_id}
+    # Convert channel ID: -1003119110887 -> 3119110887
+    channel_id_str = str(config.CHANNEL_ID)
+    if channel_id_str.startswith('-100'):
+        return f"https://t.me/c/{channel_id_str[4:]}/{channel_message_id}"
+    # For public channels with @ username
+    return f"https://t.me/{channel_id_str.replace('@', '')}/{channel_message_id}"
+
+
+def participant_card(user: User, project_type: str) -> str:
+    """Participant details posted under the forwarded project"""
+    gazetteer = get_gazetteer()
+    region_name = "N/A"
+    district_name = "N/A"
+    mahalla = "N/A"
+
+    address = user.address
+    if address:
+        region_name = gazetteer.region_name(address.region_id)
+        district_name = gazetteer.district_name(address.region_id, address.district_id)
+        mahalla = address.neighborhood or "N/A"
+
+    project_type_title = config.PROJECT_TYPES.get(project_type, {}).get('title', 'N/A')
+
+    return f"""
+📋 <b>Ishtirokchi ma'lumotlari:</b>
+
+👤 <b>Ism:</b> {user.full_name or 'N/A'}
+📍 <b>Viloyat:</b> {region_name}
+🏘 <b>Tuman:</b> {district_name}
+🏘 <b>Mahalla:</b> {mahalla}
+🏢 <b>Ish joyi:</b> {user.workplace or 'N/A'}
+📅 <b>Tug'ilgan sana:</b> {user.birth_date or 'N/A'}
+🆔 <b>Pasport:</b> {user.passport_series or 'N/A'}
+📱 <b>Telefon:</b> {user.phone_number or 'N/A'}
+🎨 <b>Loyiha turi:</b> {project_type_title}
+"""
+
+
+class ChannelOutbox:
+    def __init__(self, bot, batch_size: int = 20, poll_interval: float = 5.0, max_attempts: int = 10):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        """Start the dispatcher on the running event loop"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Channel outbox dispatcher started")
+
+    def notify(self):
+        """Wake the dispatcher after a pending project was committed"""
+        self.start()
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Channel outbox dispatcher stopped")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                while await self.dispatch_once():
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Channel outbox dispatch failed: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_once(self) -> int:
+        """Send one batch of due projects; returns how many were claimed"""
+        now = datetime.now()
+        due = or_(
+            and_(Project.status == PROJECT_PENDING,
+                 or_(Project.next_attempt_at.is_(None), Project.next_attempt_at <= now)),
+            and_(Project.status == PROJECT_SENDING, Project.next_attempt_at <= now),
+        )
+        async with AsyncSessionLocal() as db:
+            candidates = (await db.scalars(
+                select(Project.id).where(due).order_by(Project.id).limit(self.batch_size)
+            )).all()
+
+            claimed = []
+            for project_id in candidates:
+                result = await db.execute(
+                    update(Project)
+                    .where(Project.id == project_id, due)
+                    .values(status=PROJECT_SENDING, next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT))
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    claimed.append(project_id)
+            await db.commit()
+
+            if not claimed:
+                return 0
+            projects = (await db.scalars(
+                select(Project)
+                .options(joinedload(Project.user).joinedload(User.address))
+                .where(Project.id.in_(claimed))
+                .order_by(Project.id)
+            )).all()
+
+        # Connection is back in the pool; only Telegram calls from here on
+        await asyncio.gather(*(self._send(project) for project in projects))
+        return len(claimed)
+
+    async def _renew_claim(self, project_id: int):
+        """Keep a project claimed for as long as its Bot API calls take"""
+        while True:
+            await asyncio.sleep(CLAIM_RENEW_INTERVAL)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(Project)
+                        .where(Project.id == project_id, Project.status == PROJECT_SENDING)
+                        .values(next_attempt_at=datetime.now() + timedelta(seconds=CLAIM_TIMEOUT))
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning(f"Could not renew the claim on project {project_id}: {e}")
+
+    async def _send(self, project: Project):
+        values = {}
+        renewal = asyncio.create_task(self._renew_claim(project.id))
+        try:
+            if project.channel_message_id is None:
+                forwarded = await self.bot.forward_message(
+                    chat_id=config.CHANNEL_ID,
+                    from_chat_id=project.source_chat_id,
+                    message_id=project.source_message_id
+                )
+                project.channel_message_id = forwarded.message_id
+                values['channel_message_id'] = forwarded.message_id
+                values['project_url'] = project_url(forwarded.message_id)
+
+            # Send user data as reply to the forwarded message
+            await self.bot.send_message(
+                chat_id=config.CHANNEL_ID,
+                text=participant_card(project.user, project.type),
+                parse_mode='HTML',
+                reply_to_message_id=project.channel_message_id
+            )
+            values.update(status=PROJECT_SENT, next_attempt_at=None, last_error=None)
+            logger.info(f"Project {project.id} forwarded to channel: {values.get('project_url', project.project_url)}")
+        except Exception as e:
+            attempts = (project.attempts or 0) + 1
+            values['attempts'] = attempts
+            values['last_error'] = str(e)[:500]
+            if attempts >= self.max_attempts:
+                values.update(status=PROJECT_FAILED, next_attempt_at=None)
+                logger.error(f"Giving up forwarding project {project.id} after {attempts} attempts: {e}")
+            else:
+                delay = min(2 ** attempts * 5, 3600)
+                values.update(status=PROJECT_PENDING, next_attempt_at=datetime.now() + timedelta(seconds=delay))
+                logger.warning(f"Forwarding project {project.id} failed (attempt {attempts}), retrying in {delay}s: {e}")
+        finally:
+            renewal.cancel()
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Project).where(Project.id == project.id).values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
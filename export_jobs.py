@@ -0,0 +1,237 @@
+"""
+Background jobs for the admin Excel export.
+
+Workbooks are built in a thread pool so update processing is never held up.
+Each full build is keyed by a data-version stamp (row counts, max ids and the
+latest edit time); while the stamp is unchanged every admin gets the same
+file - or its Telegram file_id once it has been uploaded - and concurrent
+requests share one build. Incremental exports are built from a per-admin
+watermark and are never cached.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import select, func
+
+import metrics
+from database import AsyncSessionLocal
+from exporter import export_workbook, ExportWindow
+from models.User import User
+from models.Address import Address
+from models.Project import Project
+from models.ExportWatermark import ExportWatermark
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two progress edits of the same message
+PROGRESS_INTERVAL = 2.0
+
+STAGE_TITLES = {
+    'users': "👥 Ishtirokchilar",
+    'projects': "📁 Loyihalar",
+    'saving': "💾 Fayl saqlanmoqda",
+}
+
+
+class DataVersion(NamedTuple):
+    users: int
+    max_user_id: int
+    projects: int
+    max_project_id: int
+    last_edit: datetime
+
+
+@dataclass
+class ExportResult:
+    stamp: DataVersion
+    path: str
+    users: int
+    projects: int
+    created_at: datetime
+    window: ExportWindow = None
+    file_id: str = None
+
+
+@dataclass
+class _Job:
+    task: asyncio.Future
+    # (chat_id, message_id) of the "⏳" messages to update with progress
+    watchers: list = field(default_factory=list)
+    last_edit: float = 0.0
+
+
+async def data_version() -> DataVersion:
+    """Cheap stamp that changes whenever users or projects are added, removed or edited"""
+    async with AsyncSessionLocal() as db:
+        users = (await db.execute(
+            select(func.count(User.id), func.max(User.id), func.max(User.updated_at))
+        )).one()
+        projects = (await db.execute(
+            select(func.count(Project.id), func.max(Project.id), func.max(Project.updated_at))
+        )).one()
+        address_edit = await db.scalar(select(func.max(Address.updated_at)))
+    # Project edits include the channel outbox filling in project_url
+    edits = [edit for edit in (users[2], address_edit, projects[2]) if edit is not None]
+    return DataVersion(users[0], users[1] or 0, projects[0], projects[1] or 0, max(edits, default=None))
+
+
+async def get_watermark(admin_id: int) -> ExportWindow:
+    """Window covering everything added since the admin's last export, or None if there was none"""
+    async with AsyncSessionLocal() as db:
+        watermark = await db.get(ExportWatermark, admin_id)
+    if watermark is None:
+        return None
+    return ExportWindow(
+        user_id=watermark.last_user_id,
+        project_id=watermark.last_project_id,
+        since=watermark.exported_at
+    )
+
+
+async def save_watermark(admin_id: int, stamp: DataVersion):
+    """Remember what the admin has already received"""
+    async with AsyncSessionLocal() as db:
+        watermark = await db.get(ExportWatermark, admin_id)
+        if watermark is None:
+            watermark = ExportWatermark(admin_id=admin_id)
+            db.add(watermark)
+        watermark.last_user_id = stamp.max_user_id
+        watermark.last_project_id = stamp.max_project_id
+        # Edits are compared with ">= since", so start just after the last one seen
+        watermark.exported_at = stamp.last_edit + timedelta(microseconds=1) if stamp.last_edit else None
+        await db.commit()
+
+
+class ExportJobManager:
+    def __init__(self, bot, workers: int = 1, cache_ttl: int = 600):
+        self.bot = bot
+        self.cache_ttl = cache_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        self._dir = tempfile.mkdtemp(prefix="export_")
+        self._cached: ExportResult = None
+        self._jobs = {}
+
+    def _fresh(self, stamp) -> bool:
+        cached = self._cached
+        return (
+            cached is not None
+            and cached.stamp == stamp
+            and (datetime.now() - cached.created_at).total_seconds() < self.cache_ttl
+        )
+
+    async def get_export(self, stamp: DataVersion, watcher: tuple = None,
+                         window: ExportWindow = None) -> ExportResult:
+        """
+        Return an export for ``stamp``, building it in the background if needed.
+        ``watcher`` is the (chat_id, message_id) of a message to edit with progress.
+        ``window`` restricts the export to rows after a watermark.
+        """
+        if window is None and self._fresh(stamp):
+            logger.info(f"Reusing cached export for data version {stamp}")
+            return self._cached
+
+        key = (stamp, window)
+        job = self._jobs.get(key)
+        if job is None:
+            job = _Job(task=None)
+            job.task = asyncio.ensure_future(self._build(stamp, job, window))
+            self._jobs[key] = job
+        else:
+            logger.info(f"Joining running export for data version {stamp}")
+        if watcher:
+            job.watchers.append(watcher)
+        return await asyncio.shield(job.task)
+
+    async def _build(self, stamp: DataVersion, job: _Job, window: ExportWindow = None) -> ExportResult:
+        loop = asyncio.get_running_loop()
+        path = os.path.join(self._dir, f"export_{int(time.time() * 1000)}.xlsx")
+
+        def progress(stage: str, done: int):
+            # Called from the export thread
+            now = time.monotonic()
+            if now - job.last_edit < PROGRESS_INTERVAL:
+                return
+            job.last_edit = now
+            asyncio.run_coroutine_threadsafe(self._post_progress(job, stage, done), loop)
+
+        started = time.monotonic()
+        try:
+            totals = await loop.run_in_executor(self._executor, export_workbook, path, progress, window)
+        finally:
+            self._jobs.pop((stamp, window), None)
+        elapsed = time.monotonic() - started
+        metrics.export_seconds.observe(elapsed, "full" if window is None else "incremental")
+        logger.info(f"Export for data version {stamp} built in {elapsed:.1f}s")
+
+        result = ExportResult(stamp, path, totals['users'], totals['projects'], datetime.now(), window)
+        if window is not None:
+            return result
+
+        previous, self._cached = self._cached, result
+        if previous is not None and previous.path != path:
+            try:
+                os.unlink(previous.path)
+            except OSError:
+                pass
+        return result
+
+    async def _post_progress(self, job: _Job, stage: str, done: int):
+        text = (
+            f"⏳ Ma'lumotlar tayyorlanmoqda, iltimos kuting...\n\n"
+            f"{STAGE_TITLES.get(stage, stage)}: {done}"
+        )
+        for chat_id, message_id in list(job.watchers):
+            try:
+                await self.bot.edit_message_text(text, chat_id, message_id)
+            except Exception as e:
+                logger.warning(f"Could not update export progress for chat {chat_id}: {e}")
+
+    async def send(self, chat_id: int, result: ExportResult):
+        """Send an export to a chat, uploading the file only the first time"""
+        if result.window is None:
+            title = "📊 <b>Tanlov ma'lumotlari</b>"
+            file_name = f"Tanlov_malumotlari_{result.created_at.strftime('%d_%m_%Y')}.xlsx"
+        else:
+            title = "🆕 <b>Yangi ma'lumotlar</b>"
+            if result.window.since is not None:
+                title += f" ({result.window.since.strftime('%d.%m.%Y %H:%M')} dan beri)"
+            file_name = f"Yangi_malumotlar_{result.created_at.strftime('%d_%m_%Y_%H_%M')}.xlsx"
+        caption = (
+            f"{title}\n\n"
+            f"👥 Jami ishtirokchilar: {result.users}\n"
+            f"📁 Jami loyihalar: {result.projects}\n"
+            f"📅 Sana: {result.created_at.strftime('%d.%m.%Y %H:%M')}"
+        )
+        if result.file_id:
+            try:
+                await self.bot.send_document(chat_id, result.file_id, caption=caption, parse_mode='HTML')
+                return
+            except Exception as e:
+                logger.warning(f"Resending export by file_id failed, uploading again: {e}")
+                result.file_id = None
+
+        with open(result.path, 'rb') as file:
+            sent = await self.bot.send_document(
+                chat_id,
+                file,
+                caption=caption,
+                parse_mode='HTML',
+                visible_file_name=file_name
+            )
+        if result.window is not None:
+            # Incremental exports are per admin and never reused
+            os.unlink(result.path)
+        elif sent is not None and getattr(sent, 'document', None):
+            result.file_id = sent.document.file_id
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -0,0 +1,325 @@
+"""
+Streaming Excel export of all participants and projects.
+
+Rows are pulled with two joined queries (users + address + project count,
+projects + user + address) in server-side-cursor batches and written through
+a write-only workbook with shared named styles, so memory stays flat no
+matter how many participants there are. Incremental exports first collect
+the changed ids with indexed lookups and only touch those rows.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.utils import get_column_letter
+from sqlalchemy import select, func, union
+
+import config
+from database import SessionLocal
+from gazetteer import get_gazetteer
+from models.User import User
+from models.Address import Address
+from models.Project import Project
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round-trip from the server-side cursor
+BATCH_SIZE = 1000
+
+# Progress is reported every PROGRESS_EVERY rows
+PROGRESS_EVERY = 500
+
+USER_HEADERS = [
+    "№", "Telegram ID", "To'liq ism", "Viloyat", "Tuman", "Mahalla",
+    "Ish joyi", "Tug'ilgan sana", "Pasport", "Telefon", "Loyihalar soni"
+]
+USER_WIDTHS = [6, 14, 30, 20, 20, 25, 30, 15, 15, 16, 12]
+
+PROJECT_HEADERS = [
+    "№", "Ishtirokchi", "Telegram ID", "Loyiha turi", "Loyiha URL",
+    "Viloyat", "Tuman", "Telefon"
+]
+PROJECT_WIDTHS = [6, 30, 14, 25, 45, 20, 20, 16]
+
+
+@dataclass(frozen=True)
+class ExportWindow:
+    """
+    Watermark for an incremental export.
+    Participants with id > user_id, projects with id > project_id and rows
+    created or edited at or after ``since`` are included.
+    """
+    user_id: int = None
+    project_id: int = None
+    since: datetime = None
+
+
+def _register_styles(wb: Workbook):
+    """Register the named styles shared by every cell of the export"""
+    side = Side(style='thin', color='D3D3D3')
+    thin_border = Border(left=side, right=side, top=side, bottom=side)
+    even_row_fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
+    dark_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
+    summary_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
+    center = Alignment(horizontal="center", vertical="center")
+    center_wrap = Alignment(horizontal="center", vertical="center", wrap_text=True)
+
+    styles = [
+        NamedStyle(name="header", font=Font(bold=True, color="FFFFFF", size=12),
+                   fill=dark_fill, alignment=center, border=thin_border),
+        NamedStyle(name="data", font=Font(size=11), alignment=center_wrap, border=thin_border),
+        NamedStyle(name="data_even", font=Font(size=11), alignment=center_wrap, border=thin_border,
+                   fill=even_row_fill),
+        NamedStyle(name="link", font=Font(color="0563C1", underline="single", size=11),
+                   alignment=Alignment(horizontal="left", vertical="center"), border=thin_border),
+        NamedStyle(name="stats_title", font=Font(bold=True, size=16, color="1F4E78"),
+                   fill=PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")),
+        NamedStyle(name="summary_label", font=Font(bold=True, size=12), fill=summary_fill),
+        NamedStyle(name="summary_value", font=Font(bold=True, size=12, color="C00000"),
+                   fill=summary_fill, alignment=center),
+        NamedStyle(name="section", font=Font(bold=True, size=13, color="FFFFFF"), fill=dark_fill),
+        NamedStyle(name="stat_name", font=Font(size=11)),
+        NamedStyle(name="stat_name_even", font=Font(size=11), fill=even_row_fill),
+        NamedStyle(name="stat_count", font=Font(size=11, bold=True), alignment=center),
+        NamedStyle(name="stat_count_even", font=Font(size=11, bold=True), alignment=center,
+                   fill=even_row_fill),
+    ]
+    for style in styles:
+        wb.add_named_style(style)
+
+
+def _cell(ws, value, style: str, hyperlink: str = None):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    if hyperlink:
+        cell.hyperlink = hyperlink
+    return cell
+
+
+def _setup_sheet(ws, headers, widths):
+    for col_num, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = width
+    # Freeze the header row
+    ws.freeze_panes = 'A2'
+    ws.append([_cell(ws, header, "header") for header in headers])
+
+
+def _changed_ids(selects: list, name: str):
+    """
+    CTE of the ids matched by any of ``selects``. A UNION of single-column
+    predicates lets each branch use its own index, where one OR across
+    columns (and tables) falls back to a full scan.
+    """
+    return (selects[0] if len(selects) == 1 else union(*selects)).cte(name)
+
+
+def _changed_users(window: ExportWindow):
+    selects = []
+    if window.user_id is not None:
+        selects.append(select(User.id).where(User.id > window.user_id))
+    if window.since is not None:
+        selects += [
+            select(User.id).where(User.created_at >= window.since),
+            select(User.id).where(User.updated_at >= window.since),
+            select(User.id).join(Address, Address.id == User.address_id).where(Address.updated_at >= window.since),
+        ]
+    return _changed_ids(selects, "changed_users") if selects else None
+
+
+def _changed_projects(window: ExportWindow):
+    selects = []
+    if window.project_id is not None:
+        selects.append(select(Project.id).where(Project.id > window.project_id))
+    if window.since is not None:
+        selects += [
+            select(Project.id).where(Project.created_at >= window.since),
+            select(Project.id).where(Project.updated_at >= window.since),
+        ]
+    return _changed_ids(selects, "changed_projects") if selects else None
+
+
+def _users_query(window: ExportWindow = None):
+    changed = _changed_users(window) if window is not None else None
+    project_counts = select(Project.user_id, func.count(Project.id).label("project_count"))
+    if changed is not None:
+        # Count projects of the exported participants only
+        project_counts = project_counts.where(Project.user_id.in_(select(changed.c.id)))
+    project_counts = project_counts.group_by(Project.user_id).subquery()
+
+    stmt = select(
+        User.telegram_id, User.full_name, User.workplace, User.birth_date,
+        User.passport_series, User.phone_number,
+        Address.id.label("address_id"), Address.region_id, Address.district_id, Address.neighborhood,
+        func.coalesce(project_counts.c.project_count, 0).label("project_count"),
+    )
+    if changed is not None:
+        # Start from the changed ids, so only those users are looked up
+        stmt = stmt.select_from(changed).join(User, User.id == changed.c.id)
+    return (
+        stmt.outerjoin(Address, Address.id == User.address_id)
+        .outerjoin(project_counts, project_counts.c.user_id == User.id)
+        .order_by(User.id)
+    )
+
+
+def _projects_query(window: ExportWindow = None):
+    stmt = select(
+        Project.type, Project.project_url,
+        User.id.label("user_id"), User.full_name, User.telegram_id, User.phone_number,
+        Address.id.label("address_id"), Address.region_id, Address.district_id,
+    )
+    changed = _changed_projects(window) if window is not None else None
+    if changed is not None:
+        stmt = stmt.select_from(changed).join(Project, Project.id == changed.c.id)
+    return (
+        stmt.outerjoin(User, User.id == Project.user_id)
+        .outerjoin(Address, Address.id == User.address_id)
+        .order_by(Project.id)
+    )
+
+
+def _report(progress, stage: str, done: int):
+    if progress is not None:
+        progress(stage, done)
+
+
+def _write_users(db, ws, gazetteer, region_stats: dict, progress=None, window=None) -> int:
+    total = 0
+    rows = db.execute(_users_query(window).execution_options(yield_per=BATCH_SIZE))
+    for total, user in enumerate(rows, 1):
+        row_idx = total + 1
+        region_name = "N/A"
+        district_name = "N/A"
+        mahalla = "N/A"
+
+        if user.address_id is not None:
+            region_name = gazetteer.region_name(user.region_id)
+            district_name = gazetteer.district_name(user.region_id, user.district_id)
+            mahalla = user.neighborhood or "N/A"
+            stats_name = gazetteer.region_name(user.region_id, "Noma'lum")
+            region_stats[stats_name] = region_stats.get(stats_name, 0) + 1
+
+        # Alternate row colors for better readability
+        style = "data_even" if row_idx % 2 == 0 else "data"
+        values = [
+            total, user.telegram_id, user.full_name or "N/A", region_name, district_name, mahalla,
+            user.workplace or "N/A", user.birth_date or "N/A", user.passport_series or "N/A",
+            user.phone_number or "N/A", user.project_count
+        ]
+        ws.append([_cell(ws, value, style) for value in values])
+        if total % PROGRESS_EVERY == 0:
+            _report(progress, 'users', total)
+    return total
+
+
+def _write_projects(db, ws, gazetteer, type_stats: dict, progress=None, window=None) -> int:
+    total = 0
+    rows = db.execute(_projects_query(window).execution_options(yield_per=BATCH_SIZE))
+    for total, project in enumerate(rows, 1):
+        row_idx = total + 1
+        has_user = project.user_id is not None
+        region_name = "N/A"
+        district_name = "N/A"
+        if project.address_id is not None:
+            region_name = gazetteer.region_name(project.region_id)
+            district_name = gazetteer.district_name(project.region_id, project.district_id)
+
+        project_type_title = config.PROJECT_TYPES.get(project.type, {}).get('title', project.type)
+        type_stats[project_type_title] = type_stats.get(project_type_title, 0) + 1
+
+        style = "data_even" if row_idx % 2 == 0 else "data"
+        if project.project_url:
+            url_cell = _cell(ws, project.project_url, "link", hyperlink=project.project_url)
+        else:
+            url_cell = _cell(ws, "N/A", "link")
+        ws.append([
+            _cell(ws, total, style),
+            _cell(ws, project.full_name if has_user else "N/A", style),
+            _cell(ws, project.telegram_id if has_user else "N/A", style),
+            _cell(ws, project_type_title, style),
+            url_cell,
+            _cell(ws, region_name, style),
+            _cell(ws, district_name, style),
+            _cell(ws, project.phone_number if has_user else "N/A", style),
+        ])
+        if total % PROGRESS_EVERY == 0:
+            _report(progress, 'projects', total)
+    return total
+
+
+def _write_stats(ws, total_users: int, total_projects: int, region_stats: dict, type_stats: dict):
+    ws.column_dimensions['A'].width = 45
+    ws.column_dimensions['B'].width = 18
+
+    # Main title
+    ws.row_dimensions[1].height = 25
+    ws.merged_cells.add("A1:B1")
+    ws.append([_cell(ws, "UMUMIY STATISTIKA", "stats_title")])
+    ws.append([])
+    row = 3
+
+    # Summary statistics
+    ws.append([_cell(ws, "Jami ro'yxatdan o'tganlar:", "summary_label"),
+               _cell(ws, total_users, "summary_value")])
+    ws.append([_cell(ws, "Jami yuborilgan loyihalar:", "summary_label"),
+               _cell(ws, total_projects, "summary_value")])
+    ws.append([])
+    ws.append([])
+    row += 4
+
+    for title, stats, gap in (("VILOYATLAR BO'YICHA", region_stats, 2),
+                              ("LOYIHA TURLARI BO'YICHA", type_stats, 0)):
+        ws.row_dimensions[row].height = 20
+        ws.merged_cells.add(f"A{row}:B{row}")
+        ws.append([_cell(ws, title, "section")])
+        row += 1
+
+        # Data with alternating colors
+        for idx_stat, (name, count) in enumerate(sorted(stats.items(), key=lambda x: x[1], reverse=True), 1):
+            suffix = "_even" if idx_stat % 2 == 0 else ""
+            ws.append([_cell(ws, name, "stat_name" + suffix), _cell(ws, count, "stat_count" + suffix)])
+            row += 1
+
+        for _ in range(gap):
+            ws.append([])
+            row += 1
+
+
+def export_workbook(path: str, progress=None, window: ExportWindow = None) -> dict:
+    """
+    Write the export workbook to ``path`` - everything, or only the rows
+    selected by ``window`` for an incremental export.
+    ``progress(stage, rows_done)`` is called periodically with stage 'users',
+    'projects' and finally 'saving'.
+    Returns {'users': <count>, 'projects': <count>}.
+    """
+    wb = Workbook(write_only=True)
+    _register_styles(wb)
+    gazetteer = get_gazetteer()
+
+    ws_users = wb.create_sheet("Foydalanuvchilar")
+    ws_projects = wb.create_sheet("Loyihalar")
+    ws_stats = wb.create_sheet("Statistika")
+    _setup_sheet(ws_users, USER_HEADERS, USER_WIDTHS)
+    _setup_sheet(ws_projects, PROJECT_HEADERS, PROJECT_WIDTHS)
+
+    region_stats = {}
+    type_stats = {}
+    db = SessionLocal()
+    try:
+        total_users = _write_users(db, ws_users, gazetteer, region_stats, progress, window)
+        _report(progress, 'users', total_users)
+        total_projects = _write_projects(db, ws_projects, gazetteer, type_stats, progress, window)
+        _report(progress, 'projects', total_projects)
+    finally:
+        db.close()
+
+    _write_stats(ws_stats, total_users, total_projects, region_stats, type_stats)
+    _report(progress, 'saving', total_users + total_projects)
+    wb.save(path)
+
+    logger.info(f"Export written to {path}: {total_users} users, {total_projects} projects")
+    return {'users': total_users, 'projects': total_projects}
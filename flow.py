@@ -0,0 +1,112 @@
+"""
+Table-driven registration flow.
+
+Each ``Step`` declares the state it handles, a parser that validates and
+normalises the answer into data fields, the prompt shown when the step is
+entered and the state that follows. ``Flow.register()`` turns the table into
+router step handlers: the handler gets the state record the router already
+read, and moving on to the next step (or to the confirmation) writes state
+and data back together - one storage read and one write per answer.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+from state_storage import save_record
+
+logger = logging.getLogger(__name__)
+
+
+class Invalid(Exception):
+    """Raised by a step parser; the message is sent back and the step is asked again"""
+
+
+@dataclass(frozen=True)
+class Step:
+    state: object
+    # Text sent when the step is entered; a callable gets the collected data
+    prompt: object
+    # (message, data) -> {field: value}; None for steps handled outside the table
+    parse: Callable = None
+    # (data) -> reply markup for the prompt
+    markup: Callable = None
+    # Prompt used when the step is re-entered from the confirmation screen
+    edit_prompt: str = None
+    # State entered after a valid answer; None finishes the form
+    next: object = None
+    # While editing a completed form, a valid answer goes straight back to the confirmation
+    returns_on_edit: bool = False
+    content_types: tuple = ('text',)
+
+
+def text(field: str, pattern: str = None, error: str = None, normalise: Callable = None) -> Callable:
+    """Parser storing the message text in ``field``, optionally checked against a precompiled ``pattern``"""
+    compiled = re.compile(pattern) if pattern else None
+
+    def parse(message, data):
+        value = message.text or ''
+        if compiled is not None and not compiled.match(value):
+            raise Invalid(error)
+        return {field: normalise(value) if normalise else value}
+
+    parse.__name__ = f"parse_{field}"
+    return parse
+
+
+class Flow:
+    def __init__(self, bot, steps, on_complete: Callable, completed_field: str):
+        """
+        ``on_complete(message, data)`` is awaited when the form is filled in
+        (and is responsible for storing the next state); the form counts as
+        being edited once ``completed_field`` is present in the data.
+        """
+        self.bot = bot
+        self.steps = {step.state.name: step for step in steps}
+        self.on_complete = on_complete
+        self.completed_field = completed_field
+
+    def step(self, state) -> Step:
+        return self.steps[state.name]
+
+    def editing(self, data: dict) -> bool:
+        return data.get(self.completed_field) is not None
+
+    def register(self, router):
+        """Route every step that has a parser to the engine"""
+        for step in self.steps.values():
+            if step.parse is not None:
+                router.step(step.state, step.content_types, pass_state=True)(self._handler(step))
+
+    def _handler(self, step: Step):
+        async def handler(message, state, data):
+            await self.answer(step, message, data)
+
+        # Per-step name for the handler_seconds metric
+        handler.__name__ = f"step_{step.state.name.split(':')[-1]}"
+        return handler
+
+    async def answer(self, step: Step, message, data: dict):
+        """Validate an answer to ``step`` and move on"""
+        try:
+            data.update(step.parse(message, data))
+        except Invalid as e:
+            await self.bot.send_message(message.from_user.id, str(e))
+            return
+
+        if step.next is None or (step.returns_on_edit and self.editing(data)):
+            await self.on_complete(message, data)
+        else:
+            await self.enter(message, self.step(step.next), data)
+
+    async def enter(self, message, step: Step, data: dict):
+        """Ask the question of ``step`` and store it as the user's state together with ``data``"""
+        prompt = step.edit_prompt if step.edit_prompt and self.editing(data) else step.prompt
+        if callable(prompt):
+            prompt = prompt(data)
+        await self.bot.send_message(
+            message.from_user.id,
+            prompt,
+            reply_markup=step.markup(data) if step.markup else None
+        )
+        await save_record(self.bot.current_states, message.chat.id, message.from_user.id, step.state, data)
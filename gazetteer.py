@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+REGIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regions.json")
+
+# Minimum number of seconds between mtime checks of regions.json
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class Gazetteer:
+    """
+    Immutable, indexed view of regions.json.
+
+    Region and district ids are kept as strings, exactly as in the JSON file.
+    All lookups are dict hits - no scanning over regions or districts.
+    """
+
+    def __init__(self, raw: dict, mtime: float = 0.0):
+        self.mtime = mtime
+
+        region_names = {}
+        region_ids = {}
+        district_names = {}
+        district_ids = {}
+        for region_id, region_data in raw.items():
+            region_names[region_id] = region_data['name']
+            region_ids.setdefault(region_data['name'], region_id)
+
+            names = {}
+            ids = {}
+            for district_id, district_data in region_data.get('districts', {}).items():
+                names[district_id] = district_data['name']
+                ids.setdefault(district_data['name'], district_id)
+            district_names[region_id] = MappingProxyType(names)
+            district_ids[region_id] = MappingProxyType(ids)
+
+        # id -> name, in file order
+        self.regions = MappingProxyType(region_names)
+        # region_id -> {district_id -> name}, in file order
+        self.districts = MappingProxyType(district_names)
+        self._region_ids = MappingProxyType(region_ids)
+        self._district_ids = MappingProxyType(district_ids)
+
+    def region_id(self, name: str):
+        """Region id for a region name, or None"""
+        return self._region_ids.get(name)
+
+    def district_id(self, region_id, name: str):
+        """District id for a district name inside a region, or None"""
+        return self._district_ids.get(str(region_id), {}).get(name)
+
+    def region_name(self, region_id, default: str = 'N/A'):
+        return self.regions.get(str(region_id), default)
+
+    def district_name(self, region_id, district_id, default: str = 'N/A'):
+        return self.districts.get(str(region_id), {}).get(str(district_id), default)
+
+
+_gazetteer = Gazetteer({})
+_last_check = 0.0
+_lock = threading.Lock()
+
+
+def _load(path: str) -> Gazetteer:
+    mtime = os.path.getmtime(path)
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    logger.info(f"Loaded gazetteer from {path}: {len(raw)} regions")
+    return Gazetteer(raw, mtime)
+
+
+def get_gazetteer() -> Gazetteer:
+    """
+    Return the current gazetteer.
+
+    regions.json is re-read only when its mtime changes; the mtime itself is
+    checked at most once per RELOAD_CHECK_INTERVAL seconds.
+    """
+    global _gazetteer, _last_check
+
+    now = time.monotonic()
+    if now - _last_check < RELOAD_CHECK_INTERVAL:
+        return _gazetteer
+
+    with _lock:
+        if now - _last_check < RELOAD_CHECK_INTERVAL:
+            return _gazetteer
+        _last_check = now
+        try:
+            if os.path.getmtime(REGIONS_FILE) != _gazetteer.mtime:
+                _gazetteer = _load(REGIONS_FILE)
+        except Exception as e:
+            # Keep serving the previously loaded data
+            logger.error(f"Error loading regions: {e}")
+    return _gazetteer
+
+
+# Load once at import
+get_gazetteer()
@@ -0,0 +1,9 @@
+# gunicorn settings for the native ASGI mode: gunicorn main:app -c gunicorn.conf.py
+import config
+
+bind = f"{config.HOST}:{config.PORT}"
+workers = config.WEB_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+# Give workers time to drain their update queue on restart
+graceful_timeout = int(config.UPDATE_DRAIN_TIMEOUT) + 5
+timeout = 120
@@ -0,0 +1,80 @@
+"""
+Webhook ingestion.
+
+The raw request body is decoded once (with orjson when it is installed),
+updates of a type the bot has no handler for are dropped before any
+``telebot`` object is built, and ``build_update()`` constructs only the
+payload the update actually carries instead of running every
+``de_json`` of ``types.Update``.
+"""
+import json
+import logging
+
+from telebot import types
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Update field -> (payload type, AsyncTeleBot handler list), in types.Update argument order
+UPDATE_TYPES = {
+    'message': (types.Message, 'message_handlers'),
+    'edited_message': (types.Message, 'edited_message_handlers'),
+    'channel_post': (types.Message, 'channel_post_handlers'),
+    'edited_channel_post': (types.Message, 'edited_channel_post_handlers'),
+    'inline_query': (types.InlineQuery, 'inline_handlers'),
+    'chosen_inline_result': (types.ChosenInlineResult, 'chosen_inline_handlers'),
+    'callback_query': (types.CallbackQuery, 'callback_query_handlers'),
+    'shipping_query': (types.ShippingQuery, 'shipping_query_handlers'),
+    'pre_checkout_query': (types.PreCheckoutQuery, 'pre_checkout_query_handlers'),
+    'poll': (types.Poll, 'poll_handlers'),
+    'poll_answer': (types.PollAnswer, 'poll_answer_handlers'),
+    'my_chat_member': (types.ChatMemberUpdated, 'my_chat_member_handlers'),
+    'chat_member': (types.ChatMemberUpdated, 'chat_member_handlers'),
+    'chat_join_request': (types.ChatJoinRequest, 'chat_join_request_handlers'),
+}
+
+
+def decode(body: bytes) -> dict:
+    """Parse a webhook request body"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def update_type(update: dict):
+    """Name of the payload field an update carries, or None if it is not one we know"""
+    for key in update:
+        if key in UPDATE_TYPES:
+            return key
+    return None
+
+
+def handled_types(bot) -> frozenset:
+    """Update types that reach at least one handler (all of them if middlewares are installed)"""
+    if getattr(bot, 'middlewares', None):
+        return frozenset(UPDATE_TYPES)
+    return frozenset(name for name, (_, handlers) in UPDATE_TYPES.items() if getattr(bot, handlers, None))
+
+
+def build_update(update: dict) -> types.Update:
+    """``types.Update`` with only the payload present in ``update`` deserialized"""
+    kind = update_type(update)
+    if kind is None:
+        return types.Update.de_json(update)
+    payload = UPDATE_TYPES[kind][0].de_json(update[kind])
+    return types.Update(update['update_id'], *(payload if name == kind else None for name in UPDATE_TYPES))
+
+
+def describe(update: dict, kind: str) -> str:
+    """Short one-line summary of an update for the access log"""
+    payload = update.get(kind) or {}
+    sender = (payload.get('from') or {}).get('id', 'unknown')
+    if kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        chat = (payload.get('chat') or {}).get('id', 'unknown')
+        text = payload.get('text') or payload.get('caption') or '<no text>'
+        return f"{kind} from user {sender} in chat {chat}: {text[:50]}"
+    return f"{kind} from user {sender}"
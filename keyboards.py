@@ -0,0 +1,100 @@
+"""
+Prebuilt reply keyboards.
+
+Every keyboard is built and serialized to JSON once, on first use, and the
+cached JSON string is passed straight to ``reply_markup`` (telebot sends
+strings as-is). Region and district keyboards are rebuilt only when
+regions.json is reloaded.
+"""
+from functools import lru_cache
+
+from telebot import types
+
+import config
+from gazetteer import get_gazetteer
+
+
+def _buttons(*texts, row_width: int = 3, one_per_row: bool = True) -> str:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=row_width)
+    if one_per_row:
+        for text in texts:
+            markup.add(types.KeyboardButton(text))
+    else:
+        markup.add(*[types.KeyboardButton(text) for text in texts])
+    return markup.to_json()
+
+
+@lru_cache(maxsize=None)
+def remove() -> str:
+    return types.ReplyKeyboardRemove().to_json()
+
+
+@lru_cache(maxsize=None)
+def main_menu(is_admin: bool) -> str:
+    if is_admin:
+        return _buttons("👤 Ro'yxatdan o'tish", "📊 Ma'lumotlarni yuklab olish (Admin)",
+                        "🆕 Yangi ma'lumotlar (Admin)")
+    return _buttons("👤 Ro'yxatdan o'tish")
+
+
+@lru_cache(maxsize=None)
+def registered_menu() -> str:
+    return _buttons("➕ Loyiha yuborish", "✏️ Ma'lumotlarni tahrirlash", "🏠 Bosh sahifa",
+                    row_width=2, one_per_row=False)
+
+
+@lru_cache(maxsize=None)
+def after_update() -> str:
+    return _buttons("➕ Loyiha yuborish", "🏠 Bosh sahifa", row_width=2, one_per_row=False)
+
+
+@lru_cache(maxsize=None)
+def after_project() -> str:
+    return _buttons("➕ Yana loyiha yuborish", "🏠 Bosh sahifa", row_width=2, one_per_row=False)
+
+
+@lru_cache(maxsize=None)
+def clear_confirmation() -> str:
+    return _buttons("✅ Ha, barcha ma'lumotlarni o'chirish", "❌ Yo'q, bekor qilish",
+                    row_width=2, one_per_row=False)
+
+
+@lru_cache(maxsize=None)
+def confirmation() -> str:
+    return _buttons("✅ Ha, to'g'ri", "✏️ Tahrirlash", row_width=2, one_per_row=False)
+
+
+@lru_cache(maxsize=None)
+def edit_options() -> str:
+    return _buttons("👤 Ism", "📍 Manzil", "🏢 Ish joyi", "📅 Tug'ilgan sana",
+                    "🆔 Pasport", "📱 Telefon", "🔙 Orqaga", row_width=2, one_per_row=False)
+
+
+@lru_cache(maxsize=None)
+def phone_request() -> str:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add(types.KeyboardButton("📱 Telefon raqamni yuborish", request_contact=True))
+    return markup.to_json()
+
+
+@lru_cache(maxsize=None)
+def project_types() -> str:
+    return _buttons(*[info['title'] for info in config.PROJECT_TYPES.values()], row_width=2)
+
+
+@lru_cache(maxsize=1)
+def _region_keyboards(gazetteer) -> tuple:
+    regions = _buttons(*gazetteer.regions.values(), row_width=2)
+    districts = {
+        region_id: _buttons(*names.values(), row_width=2)
+        for region_id, names in gazetteer.districts.items()
+    }
+    return regions, districts
+
+
+def regions() -> str:
+    return _region_keyboards(get_gazetteer())[0]
+
+
+def districts(region_id) -> str:
+    return _region_keyboards(get_gazetteer())[1].get(str(region_id), remove())
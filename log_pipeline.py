@@ -0,0 +1,124 @@
+"""
+Non-blocking logging.
+
+Handlers that write to the console and to disk run on a background
+QueueListener thread; the event loop only puts records on a bounded queue.
+Hot INFO lines can be sampled or rate limited per logger, so heavy webhook
+traffic does not turn into disk-bound latency. Warnings and errors are never
+sampled.
+"""
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+def parse_sampling(spec: str) -> dict:
+    """Parse "bot=0.1,__main__=0.5" into {'bot': 0.1, '__main__': 0.5}"""
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thin out INFO (and lower) records.
+
+    ``sampling`` maps logger names to the fraction of records to keep; a name
+    also covers its child loggers. ``rate_limit`` caps INFO records per second
+    per logger (0 = unlimited); the next record let through reports how many
+    were suppressed.
+    """
+
+    def __init__(self, sampling: dict = None, rate_limit: float = 0):
+        super().__init__()
+        self.sampling = sampling or {}
+        self.rate_limit = rate_limit
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _sample_rate(self, name: str) -> float:
+        while name:
+            if name in self.sampling:
+                return self.sampling[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def _allow(self, name: str) -> tuple:
+        """Token bucket per logger; returns (allowed, suppressed_since_last_allowed)"""
+        now = time.monotonic()
+        # Rates below 1/s still need room for one whole token
+        capacity = max(self.rate_limit, 1.0)
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(name, (capacity, now, 0))
+            tokens = min(capacity, tokens + (now - updated) * self.rate_limit)
+            if tokens < 1:
+                self._buckets[name] = (tokens, now, suppressed + 1)
+                return False, 0
+            self._buckets[name] = (tokens - 1, now, 0)
+            return True, suppressed
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._sample_rate(record.name)
+        if rate < 1.0 and random.random() >= rate:
+            return False
+        if self.rate_limit > 0:
+            allowed, suppressed = self._allow(record.name)
+            if not allowed:
+                return False
+            if suppressed:
+                record.msg = f"{record.getMessage()} [{suppressed} similar messages suppressed]"
+                record.args = None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_queue_logging(handlers: list, level: int = logging.INFO, queue_size: int = 10000,
+                        sampling: dict = None, rate_limit: float = 0) -> QueueListener:
+    """
+    Route the root logger through a bounded queue to ``handlers`` running on a
+    background thread. Returns the started listener; it is stopped (and the
+    queue flushed) at interpreter exit.
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    if sampling or rate_limit:
+        queue_handler.addFilter(SamplingFilter(sampling, rate_limit))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return listener
+
+
+def stop_listener(listener: QueueListener):
+    """Flush queued records and stop the writer thread (safe to call more than once)"""
+    if listener._thread is not None:
+        listener.stop()
@@ -1,30 +1,36 @@
 import warnings
 import sys
 import os
+import atexit
 
-# Suppress warnings BEFORE any other imports
-# This prevents aiohttp from logging unclosed session warnings
+# Suppress ResourceWarnings BEFORE any other imports. The Bot API session is
+# closed explicitly at shutdown (bot_session.py), so aiohttp's unclosed
+# session/connector messages no longer need their own filters.
 warnings.filterwarnings("ignore", category=ResourceWarning)
-warnings.filterwarnings("ignore", message=".*Unclosed client session.*")
-warnings.filterwarnings("ignore", message=".*Unclosed connector.*")
-warnings.filterwarnings("ignore", message=".*ssl.*", category=ResourceWarning)
-warnings.filterwarnings("ignore", message=".*aiohttp.*", category=ResourceWarning)
 
-# Also suppress at the asyncio level
 import asyncio
+from contextlib import asynccontextmanager
 asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 
 from fastapi import FastAPI, Request, HTTPException
-from telebot import types
+from fastapi.responses import PlainTextResponse
 import config
-from database import init_db
-from bot import bot
+from database import init_db, engine, async_engine, warm_up_pool
+from bot import bot, state_storage, export_jobs, channel_outbox
+from state_storage import flush_state_storage, close_state_storage
+from update_queue import UpdateQueue
+from update_dedup import create_deduplicator
+import metrics
+import bot_session
+import ingest
+import time
 import logging
 from logging.handlers import RotatingFileHandler
+from log_pipeline import setup_queue_logging, parse_sampling
 from datetime import datetime
 
 # Create logs directory if it doesn't exist
-log_dir = os.path.join(os.path.dirname(__file__), 'logs')
+log_dir = config.LOG_DIR or os.path.join(os.path.dirname(__file__), 'logs')
 os.makedirs(log_dir, exist_ok=True)
 
 # Create handlers
@@ -53,10 +59,14 @@ console_handler.setFormatter(formatter)
 app_file_handler.setFormatter(formatter)
 error_file_handler.setFormatter(formatter)
 
-# Configure root logger
-logging.basicConfig(
+# Configure root logger - handlers run on a background thread, the event
+# loop only enqueues records
+log_listener = setup_queue_logging(
+    [console_handler, app_file_handler, error_file_handler],
     level=logging.INFO,
-    handlers=[console_handler, app_file_handler, error_file_handler]
+    queue_size=config.LOG_QUEUE_SIZE,
+    sampling=parse_sampling(config.LOG_SAMPLING),
+    rate_limit=config.LOG_RATE_LIMIT
 )
 
 logger = logging.getLogger(__name__)
@@ -68,114 +78,193 @@ logger.info(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 logger.info(f"Log directory: {log_dir}")
 logger.info("=" * 60)
 
-# Initialize FastAPI app
-app = FastAPI(title="Registration Bot", version="1.0.0")
+# Seconds each startup step may take before it is retried in the background
+# (keeps a Passenger spawn from hanging on an unreachable database or Bot API)
+STARTUP_STEP_TIMEOUT = 30
 
-# Flag to track if initialization has been done
-_initialized = False
+# Startup state, reported by the root endpoint
+_db_initialized = False
+_webhook_set = False
+_startup_retry = None
 
-def initialize_app():
-    """Initialize application - called by passenger_wsgi.py"""
-    global _initialized
-    if not _initialized:
-        try:
-            # Initialize database (but don't fail if DB is not accessible yet)
-            try:
-                init_db()
-                logger.info("Database initialized successfully")
-            except Exception as db_error:
-                logger.warning(f"Database initialization deferred: {db_error}")
-                logger.info("Database will be initialized on first request")
-            _initialized = True
-        except Exception as e:
-            logger.error(f"Error during initialization: {e}")
-            # Don't raise - allow app to start even if DB is not ready
+async def warm_up():
+    """Check the schema once and open the pool's connections before traffic arrives"""
+    global _db_initialized
+    await init_db()
+    _db_initialized = True
+    await warm_up_pool(config.DB_POOL_WARMUP)
+    logger.info(f"Database ready, {config.DB_POOL_WARMUP} pooled connections warmed up")
 
 async def setup_webhook():
-    """Setup Telegram webhook - called lazily on first request"""
-    try:
-        webhook_url = f"{config.WEBHOOK_URL}{config.WEBHOOK_PATH}"
-        await bot.remove_webhook()
+    """Register the webhook unless Telegram already has this URL"""
+    global _webhook_set
+    webhook_url = f"{config.WEBHOOK_URL}{config.WEBHOOK_PATH}"
+    info = await bot.get_webhook_info()
+    if info.url != webhook_url:
         await bot.set_webhook(url=webhook_url)
         logger.info(f"Webhook set to: {webhook_url}")
+    else:
+        logger.info("Webhook already registered, leaving it unchanged")
+    _webhook_set = True
+
+async def _retry_startup():
+    """Keep retrying the startup steps that failed (e.g. database not reachable yet)"""
+    delay = 1.0
+    while not (_db_initialized and _webhook_set):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60.0)
+        try:
+            if not _db_initialized:
+                await asyncio.wait_for(warm_up(), STARTUP_STEP_TIMEOUT)
+            if not _webhook_set:
+                await asyncio.wait_for(setup_webhook(), STARTUP_STEP_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Startup retry failed, next attempt in {delay:.0f}s: {e}")
+    logger.info("Deferred startup completed")
+
+async def startup():
+    """Warm up the database and register the webhook once per process, before serving updates"""
+    global _startup_retry
+    try:
+        await asyncio.wait_for(warm_up(), STARTUP_STEP_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Database initialization failed, retrying in background: {e!r}")
+    try:
+        await asyncio.wait_for(setup_webhook(), STARTUP_STEP_TIMEOUT)
     except Exception as e:
-        logger.error(f"Error setting webhook: {e}")
+        logger.error(f"Error setting webhook, retrying in background: {e!r}")
+    if not (_db_initialized and _webhook_set):
+        _startup_retry = asyncio.create_task(_retry_startup())
+    if update_queue is not None:
+        update_queue.start()
+    # Also picks up projects left pending by a previous run
+    channel_outbox.start()
+    logger.info(f"Worker {os.getpid()} started")
 
-# Track if webhook has been set
-_webhook_set = False
-_db_initialized = False
+async def shutdown():
+    """Finish queued updates and release connections before the process exits"""
+    if _startup_retry is not None:
+        _startup_retry.cancel()
+    if update_queue is not None:
+        await update_queue.drain(timeout=config.UPDATE_DRAIN_TIMEOUT)
+    await flush_state_storage(state_storage)
+    await channel_outbox.stop()
+    export_jobs.shutdown()
+    await bot_session.close()
+    await close_state_storage(state_storage)
+    await async_engine.dispose()
+    # Sync engine of the export threads; a connection still held by a running export is closed when it is returned
+    engine.dispose()
+    logger.info(f"Worker {os.getpid()} stopped")
 
-async def ensure_db_initialized():
-    """Ensure database is initialized (lazy initialization)"""
-    global _db_initialized
-    if not _db_initialized:
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown under a native ASGI server (uvicorn / gunicorn workers)"""
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+# Initialize FastAPI app
+app = FastAPI(title="Registration Bot", version="1.0.0", lifespan=lifespan)
+
+def initialize_app(loop: asyncio.AbstractEventLoop):
+    """
+    Run the startup phase on ``loop`` - called by passenger_wsgi.py with the
+    a2wsgi event loop, since the WSGI adapter sends no lifespan events.
+    The shutdown phase runs at interpreter exit.
+    """
+    asyncio.run_coroutine_threadsafe(startup(), loop).result()
+
+    def _shutdown():
         try:
-            init_db()
-            logger.info("Database initialized (lazy)")
-            _db_initialized = True
+            asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=config.UPDATE_DRAIN_TIMEOUT + 5)
         except Exception as e:
-            logger.error(f"Failed to initialize database: {e}")
-            raise
+            logger.error(f"Error during shutdown: {e}")
+
+    atexit.register(_shutdown)
 
 # Root endpoint
 @app.get("/")
 async def root():
-    """Root endpoint - simple status check and lazy webhook setup"""
-    global _webhook_set
-    
+    """Root endpoint - simple status check"""
     logger.info("Root endpoint accessed")
-    
-    # Ensure database is initialized
-    if not _db_initialized:
-        try:
-            await ensure_db_initialized()
-        except Exception as e:
-            logger.warning(f"Database initialization failed on root access: {e}")
-            pass  # Don't block if DB init fails
-    
-    # Setup webhook on first request
-    if not _webhook_set:
-        logger.info("Setting up webhook on first request")
-        await setup_webhook()
-        _webhook_set = True
-    
     response = {
         "status": "running",
         "message": "Registration Bot Webhook Server",
         "webhook_path": config.WEBHOOK_PATH,
-        "database_ready": _db_initialized
+        "database_ready": _db_initialized,
+        "webhook_set": _webhook_set
     }
     logger.info(f"Root endpoint response: {response}")
     return response
 
+async def process_update(json_data: dict):
+    """Run bot handlers for one update and persist its state changes"""
+    if not await update_dedup.claim(json_data.get('update_id')):
+        return
+    update = ingest.build_update(json_data)
+    try:
+        with metrics.update_seconds.time():
+            await bot.process_new_updates([update])
+    finally:
+        # Persist state changes as soon as the update is handled, so the
+        # next update is visible to whichever worker receives it
+        with metrics.state_flush_seconds.time():
+            await flush_state_storage(state_storage)
+
+# Telegram redelivers updates the webhook was slow to acknowledge; each update_id is handled once
+update_dedup = create_deduplicator(
+    config.UPDATE_DEDUP_STORE, config.UPDATE_DEDUP_WINDOW, config.UPDATE_DEDUP_TTL, engine=async_engine
+)
+
+# Updates are acknowledged immediately and processed by background workers
+update_queue = (
+    UpdateQueue(process_update, workers=config.UPDATE_WORKERS, max_size=config.UPDATE_QUEUE_SIZE)
+    if config.UPDATE_WORKERS > 0 else None
+)
+
+if update_queue is not None:
+    metrics.register_gauge("update_queue_depth", "Updates waiting to be processed", update_queue.depth)
+
+# Update types with at least one registered handler; anything else is acknowledged and dropped
+HANDLED_UPDATE_TYPES = ingest.handled_types(bot)
+
 # Webhook endpoint for Telegram
 @app.post(config.WEBHOOK_PATH)
 async def webhook(request: Request):
     """Handle incoming Telegram updates"""
+    started = time.perf_counter()
+    update_id = None
     try:
-        # Ensure database is ready
-        if not _db_initialized:
-            logger.info("Initializing database on webhook request")
-            await ensure_db_initialized()
-        
-        json_data = await request.json()
-        logger.info(f"Received webhook update: update_id={json_data.get('update_id')}")
+        json_data = ingest.decode(await request.body())
+        update_type = ingest.update_type(json_data)
+        if update_type not in HANDLED_UPDATE_TYPES:
+            logger.debug(f"Dropping unhandled update: update_id={json_data.get('update_id')}, type={update_type}")
+            return {"ok": True}
+        update_id = json_data.get('update_id')
+        if not update_dedup.accept(update_id):
+            return {"ok": True}
+        logger.info(f"Received webhook update {update_id}: {ingest.describe(json_data, update_type)}")
         
-        # Log message details if present
-        if 'message' in json_data:
-            msg = json_data['message']
-            user_id = msg.get('from', {}).get('id', 'unknown')
-            chat_id = msg.get('chat', {}).get('id', 'unknown')
-            text = msg.get('text', msg.get('caption', '<no text>'))
-            logger.info(f"Message from user {user_id} in chat {chat_id}: {text[:50]}")
-        
-        update = types.Update.de_json(json_data)
-        await bot.process_new_updates([update])
-        logger.info("Webhook processed successfully")
+        if update_queue is None:
+            await process_update(json_data)
+            logger.info("Webhook processed successfully")
+        elif not update_queue.submit(json_data):
+            # Backpressure: Telegram redelivers the update later
+            update_dedup.forget(update_id)
+            raise HTTPException(status_code=503, detail="Update queue is full")
         return {"ok": True}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing webhook: {e}", exc_info=True)
+        # Telegram redelivers after a 500; let the redelivery through the in-memory window
+        update_dedup.forget(update_id)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        metrics.webhook_seconds.observe(time.perf_counter() - started)
 
 # Health check endpoint
 @app.get("/health")
@@ -184,6 +273,14 @@ async def health_check():
     logger.info("Health check endpoint accessed")
     return {"status": "healthy", "message": "Bot is running"}
 
+# Metrics endpoint (Prometheus text format)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(token: str = ""):
+    """Latency histograms, queue depth and connection pool usage of this process"""
+    if config.METRICS_TOKEN and token != config.METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Webhook info endpoint
 @app.get("/webhook-info")
 async def webhook_info():
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Admin maintenance: schema migration, statistics rebuild and clearing all results.
+
+``clear_results()`` empties the participant tables and the data derived
+from them (statistics counters, export watermarks) in one transaction with
+set-based statements: ``TRUNCATE ... RESTART IDENTITY`` on PostgreSQL and
+unqualified DELETEs (SQLite's truncate optimisation) elsewhere. With
+``archive=True`` the rows are first copied server-side into
+``archive_<timestamp>_<table>`` tables, so nothing is transferred to the bot.
+Row counts come from PostgreSQL's table statistics or the ``stat_counters``
+table instead of ``count(*)`` scans.
+
+Used by the /clear_results confirmation; can also be run from a shell:
+
+    python maintenance.py clear-results [--no-archive]
+
+Schema migrations run once per SCHEMA_VERSION (the first process to start
+applies them); run them ahead of a deploy, or recount the statistics, with:
+
+    python maintenance.py migrate [--force]
+    python maintenance.py rebuild-stats
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import text, select, bindparam
+
+import config
+import stats
+from database import async_engine, migrate_db
+from models.StatCounter import StatCounter
+
+logger = logging.getLogger(__name__)
+
+# Participant tables in deletion order (projects -> users -> addresses)
+PARTICIPANT_TABLES = ('projects', 'users', 'addresses')
+# Tables derived from the participant tables; emptied, never archived.
+# Export watermarks hold row ids, which restart after the clear.
+DERIVED_TABLES = ('stat_counters', 'export_watermarks')
+
+
+class ClearResult(NamedTuple):
+    users: int
+    addresses: int
+    projects: int
+    archive_prefix: str = None
+
+
+async def row_counts(conn) -> dict:
+    """Approximate row counts of the participant tables without scanning them"""
+    if conn.dialect.name == 'postgresql':
+        rows = await conn.execute(
+            text(
+                "SELECT relname, n_live_tup FROM pg_stat_user_tables "
+                "WHERE schemaname = current_schema() AND relname IN :names"
+            ).bindparams(bindparam('names', expanding=True)),
+            {'names': list(PARTICIPANT_TABLES)}
+        )
+        counts = {name: int(count) for name, count in rows}
+    else:
+        totals = dict((await conn.execute(
+            select(StatCounter.kind, StatCounter.count)
+            .where(StatCounter.kind.in_([stats.USERS, stats.PROJECTS]), StatCounter.key == '')
+        )).all())
+        # Every participant has exactly one address
+        counts = {
+            'users': totals.get(stats.USERS, 0),
+            'addresses': totals.get(stats.USERS, 0),
+            'projects': totals.get(stats.PROJECTS, 0),
+        }
+    return {name: counts.get(name, 0) for name in PARTICIPANT_TABLES}
+
+
+async def _archive(conn, prefix: str):
+    quote = conn.dialect.identifier_preparer.quote
+    for table in PARTICIPANT_TABLES:
+        await conn.execute(text(f"CREATE TABLE {quote(f'{prefix}_{table}')} AS SELECT * FROM {quote(table)}"))
+
+
+async def _truncate(conn):
+    quote = conn.dialect.identifier_preparer.quote
+    tables = PARTICIPANT_TABLES + DERIVED_TABLES
+    if conn.dialect.name == 'postgresql':
+        await conn.execute(text(f"TRUNCATE {', '.join(quote(table) for table in tables)} RESTART IDENTITY"))
+        return
+    # SQLite empties a table without visiting its rows when DELETE has no
+    # WHERE clause; rowids restart by themselves once a table is empty
+    for table in tables:
+        await conn.execute(text(f"DELETE FROM {quote(table)}"))
+
+
+async def clear_results(archive: bool = True) -> ClearResult:
+    """Archive (optionally) and empty all participant data in one transaction"""
+    prefix = f"archive_{datetime.now():%Y%m%d_%H%M%S}" if archive else None
+    async with async_engine.begin() as conn:
+        counts = await row_counts(conn)
+        if prefix:
+            await _archive(conn, prefix)
+        await _truncate(conn)
+    logger.warning(
+        f"Cleared results: ~{counts['users']} users, ~{counts['addresses']} addresses, "
+        f"~{counts['projects']} projects" + (f" (archived to {prefix}_*)" if prefix else "")
+    )
+    return ClearResult(counts['users'], counts['addresses'], counts['projects'], prefix)
+
+
+async def rebuild_stats():
+    """Recount all statistics counters from the participant tables"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(stats.rebuild, True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registration bot maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    clear = commands.add_parser("clear-results", help="delete all participants, addresses and projects")
+    clear.add_argument("--no-archive", action="store_true", help="skip the archive tables")
+    migrate = commands.add_parser("migrate", help="bring the database schema up to date")
+    migrate.add_argument("--force", action="store_true", help="run even if the schema version is current")
+    commands.add_parser("rebuild-stats", help="recount the statistics counters")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == "clear-results":
+        result = asyncio.run(clear_results(archive=config.CLEAR_RESULTS_ARCHIVE and not args.no_archive))
+        print(f"Deleted ~{result.users} users, ~{result.addresses} addresses, ~{result.projects} projects"
+              + (f"; archived to {result.archive_prefix}_*" if result.archive_prefix else ""))
+    elif args.command == "migrate":
+        applied = asyncio.run(migrate_db(force=args.force))
+        print("Schema migrated" if applied else "Schema is already up to date")
+    elif args.command == "rebuild-stats":
+        asyncio.run(rebuild_stats())
+        print("Statistics counters rebuilt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+In-process latency histograms exposed in the Prometheus text format.
+
+Timings are collected per stage (webhook, handler, database query, Telegram
+API call, state flush, export build) and rendered by the ``/metrics`` route
+together with gauges such as update queue depth and connection pool usage.
+Every Passenger instance keeps its own numbers, so scrape each process or
+sum them.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# Upper bounds (seconds) shared by all latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative histogram with an optional fixed set of label names"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [bucket counts..., +Inf count, sum]
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                labels = _labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {values[-2]}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {values[-2]}")
+        return lines
+
+
+webhook_seconds = Histogram("webhook_request_seconds", "Time to answer a webhook request")
+update_seconds = Histogram("update_processing_seconds", "Time to run the handlers for one update")
+handler_seconds = Histogram("handler_seconds", "Time spent in each bot handler", labels=("handler",))
+db_query_seconds = Histogram("db_query_seconds", "Database statement execution time", labels=("engine",))
+telegram_api_seconds = Histogram("telegram_api_seconds", "Telegram Bot API request time", labels=("method",))
+state_flush_seconds = Histogram("state_flush_seconds", "Time to flush buffered FSM state writes")
+export_seconds = Histogram("export_build_seconds", "Time to build an export workbook", labels=("kind",))
+send_wait_seconds = Histogram("telegram_send_wait_seconds", "Time outgoing messages wait for the rate limiter")
+
+HISTOGRAMS = [
+    webhook_seconds, update_seconds, handler_seconds, db_query_seconds,
+    telegram_api_seconds, state_flush_seconds, export_seconds, send_wait_seconds,
+]
+
+# name -> (documentation, callable returning a number or {label_values: number}, label names)
+_gauges = {}
+
+# engine name -> connection pool, read by the db_pool_* gauges
+_pools = {}
+
+
+def register_gauge(name: str, documentation: str, collect, labels: tuple = ()):
+    """Register a gauge whose value(s) are read from ``collect()`` at scrape time"""
+    _gauges[name] = (documentation, collect, tuple(labels))
+
+
+def time_handlers(handlers: list):
+    """Wrap the registered bot handlers so each call is timed by handler name"""
+    for handler in handlers:
+        if not getattr(handler['function'], '_timed', False):
+            handler['function'] = _timed_handler(handler['function'])
+
+
+def _timed_handler(function):
+    @functools.wraps(function)
+    async def timed(*args, **kwargs):
+        with handler_seconds.time(function.__name__):
+            return await function(*args, **kwargs)
+
+    timed._timed = True
+    return timed
+
+
+def time_telegram_requests(helper):
+    """Time every Bot API request made through ``telebot.asyncio_helper``"""
+    process_request = helper._process_request
+    if getattr(process_request, '_timed', False):
+        return
+
+    @functools.wraps(process_request)
+    async def timed(token, url, *args, **kwargs):
+        with telegram_api_seconds.time(url):
+            return await process_request(token, url, *args, **kwargs)
+
+    timed._timed = True
+    helper._process_request = timed
+
+
+def time_queries(engine, name: str):
+    """Time statement execution on a (sync) engine and expose its pool usage"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        db_query_seconds.observe(time.perf_counter() - started, name)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # after_cursor_execute is skipped when the statement fails
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
+
+    if hasattr(engine.pool, 'checkedout'):
+        _pools[name] = engine.pool
+
+
+def _pool_gauge(method: str):
+    return lambda: {(name,): getattr(pool, method)() for name, pool in _pools.items()}
+
+
+register_gauge("db_pool_checked_out", "Connections currently in use", _pool_gauge("checkedout"), ("engine",))
+register_gauge("db_pool_checked_in", "Idle connections in the pool", _pool_gauge("checkedin"), ("engine",))
+register_gauge("db_pool_overflow", "Connections opened beyond pool_size (negative while the pool has spare capacity)", _pool_gauge("overflow"), ("engine",))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, (documentation, collect, label_names) in sorted(_gauges.items()):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        values = collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{name}{_labels(label_names, label_values)} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,6 @@
 from database import Base
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, func
+from sqlalchemy.orm import relationship
 
 class Address(Base):
     __tablename__ = 'addresses'
@@ -8,7 +9,14 @@ class Address(Base):
     region_id = Column(Integer, nullable=True)
     district_id = Column(Integer, nullable=True)
     neighborhood = Column(String, nullable=True)
-    user_id = Column(Integer, nullable=True)
+    # users.address_id points back here, so this side of the cycle is created with ALTER TABLE
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE', name='fk_addresses_user_id', use_alter=True),
+                     nullable=True, index=True)
+    created_at = Column(DateTime, nullable=True, default=func.now())
+    updated_at = Column(DateTime, nullable=True, default=func.now(), onupdate=func.now(), index=True)
+
+    # post_update: the user row needs the address id and vice versa
+    user = relationship('User', foreign_keys=[user_id], post_update=True)
 
     def __init__(self, region_id: int = None, district_id: int = None, neighborhood: str = None):
         self.region_id = region_id
@@ -0,0 +1,14 @@
+from database import Base
+from sqlalchemy import Column, BigInteger, String, Text, Float
+
+class BotState(Base):
+    __tablename__ = 'bot_states'
+
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=False, default="{}")
+    updated_at = Column(Float, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<BotState(chat_id={self.chat_id}, user_id={self.user_id}, state={self.state})>"
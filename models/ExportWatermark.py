@@ -0,0 +1,13 @@
+from database import Base
+from sqlalchemy import Column, Integer, BigInteger, DateTime
+
+class ExportWatermark(Base):
+    __tablename__ = 'export_watermarks'
+
+    admin_id = Column(BigInteger, primary_key=True)
+    last_user_id = Column(Integer, nullable=False, default=0)
+    last_project_id = Column(Integer, nullable=False, default=0)
+    exported_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<ExportWatermark(admin_id={self.admin_id}, last_user_id={self.last_user_id}, last_project_id={self.last_project_id})>"
@@ -0,0 +1,11 @@
+from database import Base
+from sqlalchemy import Column, BigInteger, Float
+
+class ProcessedUpdate(Base):
+    __tablename__ = 'processed_updates'
+
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    processed_at = Column(Float, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<ProcessedUpdate(update_id={self.update_id})>"
@@ -1,10 +1,30 @@
 from database import Base
-from sqlalchemy import Column, Integer, String, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Enum, DateTime, ForeignKey, func
+from sqlalchemy.orm import relationship
+
+PROJECT_PENDING = 'pending'
+PROJECT_SENDING = 'sending'
+PROJECT_SENT = 'sent'
+PROJECT_FAILED = 'failed'
 
 class Project(Base):
     __tablename__ = 'projects'
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE', name='fk_projects_user_id'),
+                     nullable=False, index=True)
     type = Column(Enum("essay", "poem", "song", "art", "craft", "video", name="project_type"), nullable=True)
-    project_url = Column(String, nullable=True)
\ No newline at end of file
+    project_url = Column(String, nullable=True)
+    # Channel delivery (see channel_outbox.py): 'pending' until forwarded, then 'sent'.
+    # NULL for projects saved before the outbox existed, which were forwarded synchronously.
+    status = Column(String(10), nullable=True, index=True)
+    source_chat_id = Column(BigInteger, nullable=True)
+    source_message_id = Column(BigInteger, nullable=True)
+    channel_message_id = Column(BigInteger, nullable=True)
+    attempts = Column(Integer, nullable=True, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=True, default=func.now(), index=True)
+    updated_at = Column(DateTime, nullable=True, default=func.now(), onupdate=func.now(), index=True)
+
+    user = relationship('User', back_populates='projects')
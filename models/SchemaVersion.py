@@ -0,0 +1,12 @@
+from database import Base
+from sqlalchemy import Column, Integer, DateTime, func
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    # One row per applied database.SCHEMA_VERSION
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    applied_at = Column(DateTime, nullable=True, default=func.now())
+
+    def __repr__(self):
+        return f"<SchemaVersion(version={self.version})>"
@@ -0,0 +1,14 @@
+from database import Base
+from sqlalchemy import Column, Integer, String
+
+class StatCounter(Base):
+    __tablename__ = 'stat_counters'
+
+    # 'users', 'projects', 'region', 'district' or 'project_type'
+    kind = Column(String(20), primary_key=True)
+    # Region id, "<region_id>:<district_id>", project type or '' for totals
+    key = Column(String(50), primary_key=True, default='')
+    count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<StatCounter(kind={self.kind}, key={self.key}, count={self.count})>"
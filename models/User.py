@@ -1,5 +1,6 @@
 from database import Base
-from sqlalchemy import Column, Integer, String, Boolean, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, BigInteger, DateTime, ForeignKey, func
+from sqlalchemy.orm import relationship
 
 class User(Base):
     __tablename__ = 'users'
@@ -7,11 +8,19 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(BigInteger, unique=True, index=True, nullable=False)
     full_name = Column(String, nullable=True)
-    address_id = Column(Integer, nullable=True)
+    address_id = Column(Integer, ForeignKey('addresses.id', ondelete='SET NULL', name='fk_users_address_id'),
+                        nullable=True, index=True)
     workplace = Column(String, nullable=True)
     birth_date = Column(String, nullable=True)
     passport_series = Column(String, nullable=True)
     phone_number = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=True, default=func.now(), index=True)
+    updated_at = Column(DateTime, nullable=True, default=func.now(), onupdate=func.now(), index=True)
+    # Random token replaced on every write, so per-process caches can tell a stale copy
+    revision = Column(BigInteger, nullable=True)
+
+    address = relationship('Address', foreign_keys=[address_id])
+    projects = relationship('Project', back_populates='user', order_by='Project.id', passive_deletes=True)
 
     def __init__(self, telegram_id: int, full_name: str = None, address_id: int = None,
                  workplace: str = None, birth_date: str = None,
@@ -12,8 +12,9 @@ sys.path.insert(0, os.path.dirname(__file__))
 from a2wsgi import ASGIMiddleware
 from main import app, initialize_app
 
-# Initialize the application (database, etc.)
-initialize_app()
-
 # FastAPI (ASGI) to WSGI adapter for Passenger
 application = ASGIMiddleware(app)
+
+# a2wsgi sends no lifespan events: run the startup phase (database warmup,
+# webhook registration) on the adapter's event loop before serving requests
+initialize_app(application.loop)
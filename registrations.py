@@ -0,0 +1,128 @@
+"""
+Participant repository.
+
+``save_participant()`` writes a participant and their address from the
+registration flow's state data with a fixed sequence of Core statements
+(INSERT ... ON CONFLICT (telegram_id) DO NOTHING RETURNING, then UPDATE ...
+RETURNING when the row already exists) instead of loading and flushing ORM
+objects. Two concurrent submissions from the same Telegram user therefore
+end up as one row updated twice rather than an IntegrityError, and only the
+submission that actually created the row counts a new participant.
+"""
+import logging
+import secrets
+from collections import Counter
+
+from sqlalchemy import select, update, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+import stats
+from models.User import User
+from models.Address import Address
+from user_cache import UserSnapshot, AddressSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def _user_values(data: dict) -> dict:
+    return {
+        'full_name': data['full_name'],
+        'workplace': data['workplace'],
+        'birth_date': data['birth_date'],
+        'passport_series': data['passport_series'],
+        'phone_number': data['phone_number'],
+        # New token on every write (see user_cache.get_registration)
+        'revision': secrets.randbits(62),
+    }
+
+
+def _address_values(data: dict) -> dict:
+    return {
+        'region_id': int(data['region_id']),
+        'district_id': int(data['district_id']),
+        'neighborhood': data.get('mahalla', ''),
+    }
+
+
+async def _insert_user(db, telegram_id: int, values: dict):
+    """Insert the user unless one with ``telegram_id`` exists; returns the new id or None"""
+    dialect = db.bind.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        stmt = (postgresql.insert(User) if dialect == 'postgresql' else sqlite.insert(User)).values(
+            telegram_id=telegram_id, **values
+        )
+        return await db.scalar(
+            stmt.on_conflict_do_nothing(index_elements=[User.telegram_id]).returning(User.id)
+        )
+    try:
+        async with db.begin_nested():
+            return await db.scalar(insert(User).values(telegram_id=telegram_id, **values).returning(User.id))
+    except IntegrityError:
+        return None
+
+
+async def _insert_address(db, user_id: int, values: dict) -> int:
+    address_id = await db.scalar(insert(Address).values(user_id=user_id, **values).returning(Address.id))
+    await db.execute(
+        update(User).where(User.id == user_id).values(address_id=address_id)
+        .execution_options(synchronize_session=False)
+    )
+    return address_id
+
+
+async def participant_id(db, telegram_id: int):
+    """
+    Id of the registered participant, read inside the session's transaction
+    and locked against a concurrent delete until it commits; None if the
+    Telegram user is not (or no longer) registered.
+    """
+    return await db.scalar(
+        select(User.id).where(User.telegram_id == telegram_id).with_for_update(read=True)
+    )
+
+
+async def save_participant(db, telegram_id: int, data: dict) -> tuple[UserSnapshot, Counter]:
+    """
+    Create or update the participant described by the registration state
+    ``data`` inside the session's transaction.
+    Returns the participant's snapshot (for ``user_cache``) and the statistics
+    changes the caller applies in the same transaction.
+    """
+    user_values = _user_values(data)
+    address_values = _address_values(data)
+    changes = stats.address_changes(address_values['region_id'], address_values['district_id'])
+
+    user_id = await _insert_user(db, telegram_id, user_values)
+    if user_id is not None:
+        address_id = await _insert_address(db, user_id, address_values)
+        changes[(stats.USERS, '')] += 1
+        logger.info(f"Registered participant {user_id} for Telegram user {telegram_id}")
+    else:
+        user_id, address_id = (await db.execute(
+            update(User).where(User.telegram_id == telegram_id).values(**user_values)
+            .returning(User.id, User.address_id)
+            .execution_options(synchronize_session=False)
+        )).one()
+        previous = None
+        if address_id is not None:
+            previous = (await db.execute(
+                select(Address.region_id, Address.district_id).where(Address.id == address_id).with_for_update()
+            )).one_or_none()
+        if previous is None:
+            address_id = await _insert_address(db, user_id, address_values)
+        else:
+            await db.execute(
+                update(Address).where(Address.id == address_id).values(**address_values)
+                .execution_options(synchronize_session=False)
+            )
+            changes.update(stats.address_changes(previous.region_id, previous.district_id, -1))
+        logger.info(f"Updated participant {user_id} for Telegram user {telegram_id}")
+
+    entry = UserSnapshot(
+        telegram_id=telegram_id,
+        user_id=user_id,
+        address=AddressSnapshot(**address_values),
+        **user_values,
+    )
+    return entry, changes
@@ -0,0 +1,99 @@
+"""
+Message dispatch by table lookup.
+
+telebot tests the filters of every registered message handler in turn, so
+each message paid for every button, command and state handler declared
+before the one that matched. The bot now registers a single telebot handler,
+``Router.dispatch``, which finds the target with dictionary lookups:
+
+1. ``/command``                   -> ``@router.command``
+2. exact button text              -> ``@router.button``
+3. (current state, content type)  -> ``@router.step``
+4. content type                   -> ``@router.fallback``
+
+The user's state and data are read once per message; step handlers
+registered with ``pass_state=True`` receive them as ``(message, state, data)``
+instead of reading the storage again.
+
+Dispatch cost no longer depends on how many handlers are registered.
+"""
+import logging
+
+from telebot import types, util
+
+from state_storage import load_record
+
+logger = logging.getLogger(__name__)
+
+
+class Router:
+    def __init__(self, bot):
+        self.bot = bot
+        self.commands = {}
+        self.buttons = {}
+        self.steps = {}
+        self.fallbacks = {}
+        # One {'function': ...} entry per handler, shared by all of its keys
+        # (same shape as telebot's handler dicts, so metrics.time_handlers can wrap them)
+        self.handlers = []
+
+    def _register(self, table: dict, keys, function, **options):
+        entry = {'function': function, **options}
+        for key in keys:
+            if key in table:
+                raise ValueError(f"Route {key!r} is already handled by {table[key]['function'].__name__}")
+            table[key] = entry
+        self.handlers.append(entry)
+        # Handlers stay plain functions, so they can still call each other directly
+        return function
+
+    def command(self, *names):
+        return lambda function: self._register(self.commands, names, function)
+
+    def button(self, *texts):
+        return lambda function: self._register(self.buttons, texts, function)
+
+    def step(self, state, content_types=('text',), pass_state: bool = False):
+        return lambda function: self._register(
+            self.steps, [(state.name, content_type) for content_type in content_types], function,
+            pass_state=pass_state
+        )
+
+    def fallback(self, *content_types):
+        return lambda function: self._register(self.fallbacks, content_types, function)
+
+    @property
+    def content_types(self) -> list:
+        """Every content type some route accepts"""
+        accepted = {'text'} if self.commands or self.buttons else set()
+        accepted.update(content_type for _, content_type in self.steps)
+        accepted.update(self.fallbacks)
+        return sorted(accepted)
+
+    async def resolve(self, message: types.Message):
+        """Handler entry for ``message`` (or None) and the user's (state, data), if they were read"""
+        if message.content_type == 'text':
+            entry = None
+            if util.is_command(message.text):
+                entry = self.commands.get(util.extract_command(message.text))
+            if entry is None:
+                entry = self.buttons.get(message.text)
+            if entry is not None:
+                return entry, None
+        record = await load_record(self.bot.current_states, message.chat.id, message.from_user.id)
+        entry = self.steps.get((record[0], message.content_type)) or self.fallbacks.get(message.content_type)
+        return entry, record
+
+    async def dispatch(self, message: types.Message):
+        entry, record = await self.resolve(message)
+        if entry is None:
+            logger.debug(f"No route for {message.content_type} from user {message.from_user.id}")
+            return
+        if entry.get('pass_state'):
+            await entry['function'](message, *record)
+        else:
+            await entry['function'](message)
+
+    def install(self):
+        """Register ``dispatch`` as the bot's only message handler"""
+        self.bot.register_message_handler(self.dispatch, content_types=self.content_types)
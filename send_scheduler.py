@@ -0,0 +1,224 @@
+"""
+Outbound Bot API scheduler.
+
+Every outgoing message (send*, forward*, copy*, edit*) passes through a
+global token bucket and a per-chat token bucket sized to Telegram's limits,
+so bursts are smoothed out instead of being answered with 429s. When the
+global bucket is contended, replies to users in private chats go before
+channel and group posts. A 429 pauses the affected chat (or everything, for
+a global flood wait) for ``retry_after`` seconds and the request is retried;
+network errors and 5xx responses are retried with exponential backoff.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException, RequestTimeout
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priorities (lower is served first)
+PRIORITY_USER = 0
+PRIORITY_CHANNEL = 1
+
+# Bot API methods that count against Telegram's message limits
+LIMITED_PREFIXES = ("send", "forward", "copy", "edit")
+
+# Per-chat buckets idle for this many seconds are dropped
+BUCKET_IDLE_TTL = 600
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(self.paused_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.take()
+                return
+            await asyncio.sleep(wait)
+
+
+class PriorityLimiter:
+    """Token bucket whose waiters are released in priority order"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.bucket = TokenBucket(rate, capacity)
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self.bucket.delay() <= 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            await self.bucket.acquire()
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                # Every waiter was cancelled; give the token back
+                self.bucket.tokens += 1
+
+    def depth(self) -> int:
+        return len(self._waiters)
+
+
+def _retry_after(error: ApiTelegramException) -> float:
+    parameters = (error.result_json or {}).get('parameters') or {}
+    return float(parameters.get('retry_after', 1))
+
+
+class SendScheduler:
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, max_retries: int = 5):
+        self.limiter = PriorityLimiter(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats = {}
+        self._last_cleanup = time.monotonic()
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id.startswith('-') or chat_id.startswith('@'):
+                # Groups and channels: ~20 messages per minute
+                bucket = TokenBucket(self.group_rate, max(self.group_rate * 10, 1))
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        now = time.monotonic()
+        if now - self._last_cleanup > BUCKET_IDLE_TTL:
+            self._last_cleanup = now
+            for key in [key for key, value in self._chats.items() if now - value.updated > BUCKET_IDLE_TTL]:
+                if key != chat_id:
+                    del self._chats[key]
+        return bucket
+
+    @staticmethod
+    def priority(chat_id: str) -> int:
+        return PRIORITY_CHANNEL if chat_id.startswith('-') or chat_id.startswith('@') else PRIORITY_USER
+
+    async def _wait_turn(self, chat_id):
+        started = time.monotonic()
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+            await self.limiter.acquire(self.priority(chat_id))
+        else:
+            await self.limiter.acquire(PRIORITY_USER)
+        metrics.send_wait_seconds.observe(time.monotonic() - started)
+
+    async def request(self, process_request, token, url, method='get', params=None, files=None, **kwargs):
+        limited = url.startswith(LIMITED_PREFIXES)
+        chat_id = str(params['chat_id']) if params and 'chat_id' in params else None
+        attempt = 0
+        while True:
+            attempt += 1
+            if limited:
+                await self._wait_turn(chat_id)
+            try:
+                # _process_request pops from params, so every attempt gets a copy
+                return await process_request(token, url, method, dict(params) if params else params, files, **kwargs)
+            except ApiTelegramException as e:
+                if attempt > self.max_retries or not (e.error_code == 429 or e.error_code >= 500):
+                    raise
+                if e.error_code == 429:
+                    delay = _retry_after(e)
+                    if chat_id is not None:
+                        self._chat_bucket(chat_id).pause(delay)
+                    else:
+                        self.limiter.bucket.pause(delay)
+                    logger.warning(f"Flood wait on {url} for chat {chat_id}: retrying in {delay:.0f}s "
+                                   f"(attempt {attempt}/{self.max_retries})")
+                else:
+                    delay = min(2 ** attempt, 30)
+                    logger.warning(f"{url} failed with {e.error_code}, retrying in {delay}s")
+            except RequestTimeout as e:
+                if attempt > self.max_retries:
+                    raise
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"{url} request failed ({e.__class__.__name__}), retrying in {delay}s")
+            if not _rewind(files):
+                raise RuntimeError(f"Cannot retry {url}: uploaded file is not seekable")
+            await asyncio.sleep(delay)
+
+
+def _rewind(files) -> bool:
+    """Seek uploaded files back to the start so they can be sent again"""
+    for value in (files or {}).values():
+        file = value[1] if isinstance(value, tuple) else getattr(value, 'file', value)
+        if isinstance(file, (str, bytes)):
+            continue
+        if not hasattr(file, 'seek'):
+            return False
+        file.seek(0)
+    return True
+
+
+def install() -> SendScheduler:
+    """Route every Bot API request made through ``telebot.asyncio_helper`` through the scheduler"""
+    process_request = asyncio_helper._process_request
+    if getattr(process_request, 'scheduler', None) is not None:
+        return process_request.scheduler
+
+    scheduler = SendScheduler(
+        global_rate=config.SEND_GLOBAL_RATE,
+        chat_rate=config.SEND_CHAT_RATE,
+        chat_burst=config.SEND_CHAT_BURST,
+        group_rate=config.SEND_GROUP_RATE / 60,
+        max_retries=config.SEND_MAX_RETRIES,
+    )
+
+    async def scheduled(token, url, method='get', params=None, files=None, **kwargs):
+        return await scheduler.request(process_request, token, url, method, params, files, **kwargs)
+
+    scheduled.scheduler = scheduler
+    asyncio_helper._process_request = scheduled
+    metrics.register_gauge("send_queue_depth", "Outgoing Bot API requests waiting for the global rate limit",
+                           scheduler.limiter.depth)
+    return scheduler
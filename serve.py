@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Native ASGI entry point.
+
+Runs the app directly under uvicorn with lifespan events and
+config.WEB_WORKERS worker processes - no WSGI adapter in between, so one
+process handles many webhook requests concurrently. For gunicorn use:
+
+    gunicorn main:app -c gunicorn.conf.py
+"""
+import uvicorn
+
+import config
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "main:app",
+        host=config.HOST,
+        port=config.PORT,
+        workers=config.WEB_WORKERS,
+        lifespan="on",
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+        log_level="info"
+    )
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import time
+
+from sqlalchemy import event, select, delete
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from telebot.asyncio_storage import StateMemoryStorage
+from telebot.asyncio_storage.base_storage import StateStorageBase, StateContext
+
+import config
+import metrics
+from database import async_engine, async_url, normalize_url
+from models.BotState import BotState
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) expired states are purged from the shared table
+PURGE_INTERVAL = 300
+
+
+class StateDatabaseStorage(StateStorageBase):
+    """
+    FSM state storage shared by all worker processes.
+
+    States live in the ``bot_states`` table, so every Passenger instance sees
+    the same registration progress. Writes are buffered and flushed in a single
+    transaction by ``flush()`` (called after each update is processed), every
+    read goes to the shared table unless ``cache_ttl`` enables an in-process
+    cache (only safe when one process serves the bot), and flows idle for
+    longer than ``ttl`` seconds are treated as abandoned and purged.
+    """
+
+    def __init__(self, engine, ttl: int = 7 * 24 * 3600, cache_ttl: float = 0.0, batch_size: int = 50):
+        self.engine = engine
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.batch_size = batch_size
+        # {(chat_id, user_id): (expires_at, record or None)}
+        self._cache = {}
+        # {(chat_id, user_id): record or None} - None means the row must be deleted
+        self._pending = {}
+        # Batch being written by the running flush(); still authoritative for reads until it commits
+        self._inflight = {}
+        self._flush_lock = asyncio.Lock()
+        self._table_ready = False
+        self._last_purge = 0.0
+
+    async def _ensure_table(self):
+        if not self._table_ready:
+            async with self.engine.begin() as conn:
+                await conn.run_sync(BotState.__table__.create, checkfirst=True)
+            self._table_ready = True
+
+    async def _load(self, chat_id, user_id):
+        key = (chat_id, user_id)
+        if key in self._pending:
+            return self._pending[key]
+        if key in self._inflight:
+            return self._inflight[key]
+
+        now = time.time()
+        cached = self._cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        await self._ensure_table()
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(
+                select(BotState.state, BotState.data, BotState.updated_at)
+                .where(BotState.chat_id == chat_id, BotState.user_id == user_id)
+            )).first()
+
+        record = None
+        if row and row.updated_at >= now - self.ttl:
+            record = {'state': row.state, 'data': json.loads(row.data)}
+
+        if self.cache_ttl > 0:
+            self._cache[key] = (now + self.cache_ttl, record)
+        return record
+
+    async def _write(self, chat_id, user_id, record):
+        key = (chat_id, user_id)
+        self._pending[key] = record
+        if self.cache_ttl > 0:
+            self._cache[key] = (time.time() + self.cache_ttl, record)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    def _upsert(self, values):
+        dialect = self.engine.dialect.name
+        if dialect == 'postgresql':
+            stmt = postgresql.insert(BotState).values(values)
+        elif dialect == 'sqlite':
+            stmt = sqlite.insert(BotState).values(values)
+        else:
+            return None
+        return stmt.on_conflict_do_update(
+            index_elements=[BotState.chat_id, BotState.user_id],
+            set_={
+                'state': stmt.excluded.state,
+                'data': stmt.excluded.data,
+                'updated_at': stmt.excluded.updated_at,
+            }
+        )
+
+    async def flush(self):
+        """
+        Write all buffered state changes to the shared table in one transaction.
+        Concurrent callers wait for a running flush, so every change buffered
+        before the call is committed when it returns.
+        """
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+
+        pending = self._inflight = self._pending
+        self._pending = {}
+        now = time.time()
+        try:
+            await self._ensure_table()
+            async with self.engine.begin() as conn:
+                for (chat_id, user_id), record in pending.items():
+                    if record is None:
+                        await conn.execute(
+                            delete(BotState)
+                            .where(BotState.chat_id == chat_id, BotState.user_id == user_id)
+                        )
+
+                upserts = [
+                    {
+                        'chat_id': chat_id,
+                        'user_id': user_id,
+                        'state': record['state'],
+                        'data': json.dumps(record['data'], ensure_ascii=False),
+                        'updated_at': now,
+                    }
+                    for (chat_id, user_id), record in pending.items() if record is not None
+                ]
+                if upserts:
+                    stmt = self._upsert(upserts)
+                    if stmt is not None:
+                        await conn.execute(stmt)
+                    else:
+                        for values in upserts:
+                            await conn.execute(
+                                delete(BotState)
+                                .where(BotState.chat_id == values['chat_id'],
+                                       BotState.user_id == values['user_id'])
+                            )
+                        await conn.execute(BotState.__table__.insert(), upserts)
+
+                if now - self._last_purge > PURGE_INTERVAL:
+                    result = await conn.execute(delete(BotState).where(BotState.updated_at < now - self.ttl))
+                    self._last_purge = now
+                    if result.rowcount:
+                        logger.info(f"Purged {result.rowcount} expired registration states")
+        except Exception as e:
+            logger.error(f"Error flushing {len(pending)} state changes: {e}", exc_info=True)
+            # Keep the changes so the next flush retries them (newer writes win)
+            for key, record in pending.items():
+                self._pending.setdefault(key, record)
+            self._cache.clear()
+            raise
+        finally:
+            self._inflight = {}
+
+    async def set_state(self, chat_id, user_id, state):
+        if hasattr(state, 'name'):
+            state = state.name
+        record = await self._load(chat_id, user_id)
+        if record is None:
+            record = {'state': state, 'data': {}}
+        else:
+            record = {'state': state, 'data': record['data']}
+        await self._write(chat_id, user_id, record)
+        return True
+
+    async def delete_state(self, chat_id, user_id):
+        if await self._load(chat_id, user_id) is None:
+            return False
+        await self._write(chat_id, user_id, None)
+        return True
+
+    async def get_state(self, chat_id, user_id):
+        record = await self._load(chat_id, user_id)
+        return record['state'] if record else None
+
+    async def get_data(self, chat_id, user_id):
+        record = await self._load(chat_id, user_id)
+        return record['data'] if record else None
+
+    async def reset_data(self, chat_id, user_id):
+        record = await self._load(chat_id, user_id)
+        if record is None:
+            return False
+        await self._write(chat_id, user_id, {'state': record['state'], 'data': {}})
+        return True
+
+    async def set_data(self, chat_id, user_id, key, value):
+        record = await self._load(chat_id, user_id)
+        if record is None:
+            raise RuntimeError('chat_id {} and user_id {} does not exist'.format(chat_id, user_id))
+        data = dict(record['data'])
+        data[key] = value
+        await self._write(chat_id, user_id, {'state': record['state'], 'data': data})
+        return True
+
+    async def get_record(self, chat_id, user_id):
+        """State and data in a single read; (None, {}) if the user has no state"""
+        record = await self._load(chat_id, user_id)
+        return (record['state'], dict(record['data'])) if record else (None, {})
+
+    async def set_record(self, chat_id, user_id, state, data):
+        """Replace state and data with a single write"""
+        if hasattr(state, 'name'):
+            state = state.name
+        await self._write(chat_id, user_id, {'state': state, 'data': dict(data)})
+
+    def get_interactive_data(self, chat_id, user_id):
+        return StateContext(self, chat_id, user_id)
+
+    async def save(self, chat_id, user_id, data):
+        record = await self._load(chat_id, user_id)
+        if record is None:
+            raise RuntimeError('chat_id {} and user_id {} does not exist'.format(chat_id, user_id))
+        await self._write(chat_id, user_id, {'state': record['state'], 'data': data})
+
+
+def _create_state_engine(url: str):
+    """Create a dedicated async engine for the state table (SQLite files run in WAL mode)"""
+    url = async_url(normalize_url(url))
+    if url.startswith("sqlite"):
+        engine = create_async_engine(url, connect_args={"timeout": 30})
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def _set_sqlite_pragma(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        return engine
+
+    return create_async_engine(url, pool_size=5, max_overflow=10)
+
+
+def create_state_storage():
+    """Build the FSM state storage selected by config.STATE_STORAGE"""
+    if config.STATE_STORAGE == "memory":
+        logger.info("Using in-process memory state storage")
+        return StateMemoryStorage()
+
+    if config.STATE_DATABASE_URL:
+        engine = _create_state_engine(config.STATE_DATABASE_URL)
+        metrics.time_queries(engine.sync_engine, "state")
+        logger.info(f"Using database state storage on a dedicated {engine.dialect.name} engine")
+    else:
+        engine = async_engine
+        logger.info("Using database state storage on the main database engine")
+
+    return StateDatabaseStorage(
+        engine,
+        ttl=config.STATE_TTL,
+        cache_ttl=config.STATE_CACHE_TTL,
+        batch_size=config.STATE_BATCH_SIZE
+    )
+
+
+async def flush_state_storage(storage):
+    """Flush buffered state writes, if the storage buffers them"""
+    if isinstance(storage, StateDatabaseStorage):
+        await storage.flush()
+
+
+async def close_state_storage(storage):
+    """Dispose the storage's dedicated engine; the main engine is disposed by the caller"""
+    if isinstance(storage, StateDatabaseStorage) and storage.engine is not async_engine:
+        await storage.engine.dispose()
+
+
+async def load_record(storage, chat_id, user_id):
+    """(state, data) of a user, read once from whichever storage is configured"""
+    if isinstance(storage, StateDatabaseStorage):
+        return await storage.get_record(chat_id, user_id)
+    state = await storage.get_state(chat_id, user_id)
+    data = await storage.get_data(chat_id, user_id) if state is not None else None
+    return state, dict(data or {})
+
+
+async def save_record(storage, chat_id, user_id, state, data):
+    """Set a user's state and data together"""
+    if isinstance(storage, StateDatabaseStorage):
+        await storage.set_record(chat_id, user_id, state, data)
+        return
+    await storage.set_state(chat_id, user_id, state)
+    await storage.save(chat_id, user_id, dict(data))
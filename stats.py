@@ -0,0 +1,125 @@
+"""
+Pre-aggregated participant statistics.
+
+Counts per region, district and project type are kept in the
+``stat_counters`` table and adjusted in the same transaction as the rows they
+count, so ``/stats`` answers with a single small query instead of scanning
+users and projects.
+"""
+import logging
+from collections import Counter
+
+from sqlalchemy import select, delete, func, update, insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.User import User
+from models.Address import Address
+from models.Project import Project
+from models.StatCounter import StatCounter
+
+logger = logging.getLogger(__name__)
+
+USERS = 'users'
+PROJECTS = 'projects'
+REGION = 'region'
+DISTRICT = 'district'
+PROJECT_TYPE = 'project_type'
+
+
+def _district_key(region_id, district_id) -> str:
+    return f"{region_id}:{district_id}"
+
+
+def address_changes(region_id, district_id, delta: int = 1) -> Counter:
+    """Counter changes for an address being added (delta=1) or removed (delta=-1)"""
+    changes = Counter()
+    if region_id is not None:
+        changes[(REGION, str(region_id))] += delta
+        changes[(DISTRICT, _district_key(region_id, district_id))] += delta
+    return changes
+
+
+def project_changes(project_type) -> Counter:
+    """Counter changes for a newly submitted project"""
+    return Counter({(PROJECTS, ''): 1, (PROJECT_TYPE, project_type or ''): 1})
+
+
+def _upsert(dialect: str, rows: list):
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(StatCounter).values(rows)
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(StatCounter).values(rows)
+    else:
+        return None
+    return stmt.on_conflict_do_update(
+        index_elements=[StatCounter.kind, StatCounter.key],
+        set_={'count': StatCounter.count + stmt.excluded.count}
+    )
+
+
+async def apply(db, changes: Counter):
+    """
+    Add ``changes`` ({(kind, key): delta}) to the counters as part of the
+    session's current transaction. Increments are done in SQL, so concurrent
+    workers never overwrite each other.
+    """
+    rows = [
+        {'kind': kind, 'key': key, 'count': delta}
+        for (kind, key), delta in sorted(changes.items()) if delta
+    ]
+    if not rows:
+        return
+    stmt = _upsert(db.bind.dialect.name, rows)
+    if stmt is not None:
+        await db.execute(stmt)
+        return
+    for row in rows:
+        result = await db.execute(
+            update(StatCounter)
+            .where(StatCounter.kind == row['kind'], StatCounter.key == row['key'])
+            .values(count=StatCounter.count + row['count'])
+        )
+        if not result.rowcount:
+            await db.execute(insert(StatCounter).values(row))
+
+
+async def get_stats(db) -> dict:
+    """All counters as {kind: {key: count}}"""
+    stats = {USERS: {}, PROJECTS: {}, REGION: {}, DISTRICT: {}, PROJECT_TYPE: {}}
+    rows = await db.execute(select(StatCounter.kind, StatCounter.key, StatCounter.count))
+    for kind, key, count in rows:
+        if count:
+            stats.setdefault(kind, {})[key] = count
+    return stats
+
+
+def rebuild(conn, force: bool = False):
+    """
+    Recompute all counters from the participant tables.
+    Runs at startup (via ``run_sync``) when the counters are empty but there
+    is data to count, e.g. right after upgrading an existing database.
+    """
+    if not force:
+        has_counters = conn.execute(select(func.count()).select_from(StatCounter)).scalar()
+        has_users = conn.execute(select(func.count()).select_from(User)).scalar()
+        if has_counters or not has_users:
+            return
+
+    changes = Counter()
+    changes[(USERS, '')] = conn.execute(select(func.count()).select_from(User)).scalar()
+    changes[(PROJECTS, '')] = conn.execute(select(func.count()).select_from(Project)).scalar()
+    addresses = conn.execute(
+        select(Address.region_id, Address.district_id, func.count())
+        .join(User, User.address_id == Address.id)
+        .group_by(Address.region_id, Address.district_id)
+    )
+    for region_id, district_id, count in addresses:
+        changes.update(address_changes(region_id, district_id, count))
+    for project_type, count in conn.execute(select(Project.type, func.count()).group_by(Project.type)):
+        changes[(PROJECT_TYPE, project_type or '')] += count
+
+    conn.execute(delete(StatCounter))
+    rows = [{'kind': kind, 'key': key, 'count': count} for (kind, key), count in changes.items() if count]
+    if rows:
+        conn.execute(insert(StatCounter), rows)
+    logger.info(f"Rebuilt statistics counters: {changes[(USERS, '')]} users, {changes[(PROJECTS, '')]} projects")
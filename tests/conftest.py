@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# Modules read their configuration at import time
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bot_tests_'), 'test.db')}")
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="bot_test_logs_"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Register every mapped class, as the application does, before mappers are configured
+from database import _import_models  # noqa: E402
+
+_import_models()
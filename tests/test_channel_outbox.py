@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import channel_outbox
+from channel_outbox import ChannelOutbox
+from database import AsyncSessionLocal, init_db
+from models.Project import Project, PROJECT_PENDING, PROJECT_SENDING, PROJECT_SENT
+from models.User import User
+
+
+class SlowBot:
+    """Bot API stub whose forward takes longer than a claim renewal interval"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.claims_seen = []
+
+    async def forward_message(self, chat_id, from_chat_id, message_id):
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(message_id=42)
+
+    async def send_message(self, **kwargs):
+        return SimpleNamespace(message_id=43)
+
+
+def test_claim_is_renewed_while_a_send_is_slow():
+    async def scenario():
+        await init_db()
+        async with AsyncSessionLocal() as db:
+            user = User(telegram_id=880001, full_name="Slow sender")
+            db.add(user)
+            await db.flush()
+            project = Project(user_id=user.id, type="essay", status=PROJECT_PENDING,
+                              source_chat_id=880001, source_message_id=1)
+            db.add(project)
+            await db.commit()
+            project_id = project.id
+
+        outbox = ChannelOutbox(SlowBot(delay=0.3))
+        with mock.patch.object(channel_outbox, "CLAIM_TIMEOUT", 0.2), \
+                mock.patch.object(channel_outbox, "CLAIM_RENEW_INTERVAL", 0.05):
+            dispatch = asyncio.create_task(outbox.dispatch_once())
+            await asyncio.sleep(0.25)
+            async with AsyncSessionLocal() as db:
+                claimed = await db.get(Project, project_id)
+                # Without renewal the claim would have expired by now and another worker could resend
+                assert claimed.status == PROJECT_SENDING
+                assert claimed.next_attempt_at > datetime.now()
+                assert await outbox.dispatch_once() == 0
+            assert await dispatch == 1
+
+        async with AsyncSessionLocal() as db:
+            sent = await db.get(Project, project_id)
+            assert sent.status == PROJECT_SENT and sent.channel_message_id == 42
+
+    asyncio.run(scenario())
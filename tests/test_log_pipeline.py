@@ -0,0 +1,23 @@
+import logging
+from unittest import mock
+
+from log_pipeline import SamplingFilter
+
+
+def _record(message="step"):
+    return logging.LogRecord("bot", logging.INFO, __file__, 1, message, None, None)
+
+
+def test_rate_limit_below_one_per_second_lets_records_through():
+    log_filter = SamplingFilter(rate_limit=0.5)
+    with mock.patch("log_pipeline.time.monotonic", return_value=100.0):
+        assert log_filter.filter(_record())
+        assert not log_filter.filter(_record())
+
+    # One token every two seconds
+    with mock.patch("log_pipeline.time.monotonic", return_value=101.0):
+        assert not log_filter.filter(_record())
+    with mock.patch("log_pipeline.time.monotonic", return_value=102.0):
+        record = _record()
+        assert log_filter.filter(record)
+        assert "[2 similar messages suppressed]" in record.getMessage()
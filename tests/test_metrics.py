@@ -0,0 +1,18 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import metrics
+
+
+def test_failed_statements_do_not_leak_query_timers():
+    engine = create_engine("sqlite://")
+    metrics.time_queries(engine, "test")
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing_table"))
+        assert conn.info['query_started'] == []
+
+        conn.execute(text("SELECT 1"))
+        assert conn.info['query_started'] == []
+    engine.dispose()
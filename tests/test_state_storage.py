@@ -0,0 +1,74 @@
+import asyncio
+import os
+import tempfile
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from state_storage import StateDatabaseStorage
+
+
+def _storage():
+    path = os.path.join(tempfile.mkdtemp(prefix="state_"), "states.db")
+    return StateDatabaseStorage(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+
+
+def test_reads_and_flushes_during_a_running_flush_see_the_batch():
+    async def scenario():
+        storage = _storage()
+        await storage.set_record(1, 1, "old", {})
+        await storage.flush()
+
+        await storage.set_record(1, 1, "new", {'step': 2})
+        # Hold the first flush after it has taken the batch, before it writes
+        release = asyncio.Event()
+        ensure_table = storage._ensure_table
+
+        async def paused_ensure_table():
+            await release.wait()
+            await ensure_table()
+
+        storage._ensure_table = paused_ensure_table
+        first = asyncio.create_task(storage.flush())
+        await asyncio.sleep(0)
+        assert storage._pending == {} and (1, 1) in storage._inflight
+
+        # The batch is neither pending nor committed, reads must still see it
+        assert await storage.get_record(1, 1) == ("new", {'step': 2})
+
+        second = asyncio.create_task(storage.flush())
+        await asyncio.sleep(0.05)
+        assert not second.done(), "a concurrent flush must wait for the running one"
+
+        release.set()
+        await asyncio.gather(first, second)
+        assert storage._inflight == {}
+
+        fresh = StateDatabaseStorage(storage.engine)
+        assert await fresh.get_record(1, 1) == ("new", {'step': 2})
+        await storage.engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_keeps_the_batch_for_the_next_one():
+    async def scenario():
+        storage = _storage()
+        await storage.set_record(1, 1, "step", {})
+
+        async def failing_ensure_table():
+            raise RuntimeError("database unavailable")
+
+        ensure_table, storage._ensure_table = storage._ensure_table, failing_ensure_table
+        try:
+            await storage.flush()
+        except RuntimeError:
+            pass
+        assert storage._inflight == {} and (1, 1) in storage._pending
+        assert await storage.get_record(1, 1) == ("step", {})
+
+        storage._ensure_table = ensure_table
+        await storage.flush()
+        assert storage._pending == {}
+        await storage.engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,40 @@
+import asyncio
+import time
+from unittest import mock
+
+import user_cache
+from database import init_db
+from user_cache import MemoryUserCache, UserSnapshot
+
+
+def test_reads_keep_an_entry_alive():
+    cache = MemoryUserCache(ttl=10)
+    entry = UserSnapshot(1, user_id=1)
+
+    async def scenario():
+        with mock.patch("user_cache.time.monotonic", return_value=100.0):
+            await cache.put(entry)
+        with mock.patch("user_cache.time.monotonic", return_value=108.0):
+            assert await cache.get(1) is entry
+        with mock.patch("user_cache.time.monotonic", return_value=116.0):
+            assert await cache.get(1) is entry
+        with mock.patch("user_cache.time.monotonic", return_value=127.0):
+            assert await cache.get(1) is None
+
+    asyncio.run(scenario())
+
+
+def test_recently_checked_entries_skip_the_database():
+    telegram_id = 770001  # no such user row
+
+    async def scenario():
+        await init_db()
+        with mock.patch.object(user_cache.config, "USER_CACHE_TRUST", 5):
+            await user_cache.remember(UserSnapshot(telegram_id, user_id=1, revision=1))
+            assert (await user_cache.get_registration(telegram_id)).registered
+
+            await user_cache.remember(UserSnapshot(telegram_id, user_id=1, revision=1, checked_at=time.time() - 6))
+            assert not (await user_cache.get_registration(telegram_id)).registered
+            assert await user_cache.cache.get(telegram_id) is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,113 @@
+"""
+Deduplication of Telegram webhook redeliveries.
+
+Telegram resends an update when the webhook is slow or answers with an
+error. ``UpdateDeduplicator`` keeps a bounded window of recently accepted
+``update_id``s in memory, so a redelivery reaching the same process is
+acknowledged without being queued, and - with the database store - claims
+every update in the shared ``processed_updates`` table right before its
+handlers run, so a redelivery that reaches another worker process is
+skipped as well.
+
+An update is claimed before it is processed: if a process dies half-way
+through one, the redelivery is not processed again. That errs on the side
+of never forwarding a project or inserting a row twice.
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from models.ProcessedUpdate import ProcessedUpdate
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) old claims are purged from the shared table
+PURGE_INTERVAL = 300
+
+
+class UpdateDeduplicator:
+    def __init__(self, window: int = 10000, engine=None, ttl: float = 24 * 3600):
+        """``engine`` enables the shared store; ``ttl`` is how long claims are kept in it"""
+        self.window = window
+        self.engine = engine
+        self.ttl = ttl
+        self._recent = OrderedDict()
+        self._last_purge = 0.0
+        self.duplicates = 0
+
+    def seen(self, update_id: int) -> bool:
+        """True if this process already accepted ``update_id``"""
+        return update_id in self._recent
+
+    def remember(self, update_id: int):
+        self._recent[update_id] = None
+        self._recent.move_to_end(update_id)
+        while len(self._recent) > self.window:
+            self._recent.popitem(last=False)
+
+    def forget(self, update_id: int):
+        """Drop an update that was not accepted after all (e.g. the queue was full)"""
+        self._recent.pop(update_id, None)
+
+    def accept(self, update_id: int) -> bool:
+        """Remember ``update_id``; False if it is a redelivery of an update this process accepted"""
+        if update_id is None:
+            return True
+        if self.seen(update_id):
+            self.duplicates += 1
+            logger.info(f"Ignoring redelivered update {update_id}")
+            return False
+        self.remember(update_id)
+        return True
+
+    def _insert(self, values: dict):
+        dialect = self.engine.dialect.name
+        if dialect == 'postgresql':
+            stmt = postgresql.insert(ProcessedUpdate).values(values)
+        elif dialect == 'sqlite':
+            stmt = sqlite.insert(ProcessedUpdate).values(values)
+        else:
+            return None
+        return stmt.on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+
+    async def claim(self, update_id: int) -> bool:
+        """Claim ``update_id`` in the shared store; False if another process already did"""
+        if self.engine is None or update_id is None:
+            return True
+        now = time.time()
+        values = {'update_id': update_id, 'processed_at': now}
+        async with self.engine.begin() as conn:
+            stmt = self._insert(values)
+            if stmt is not None:
+                claimed = (await conn.execute(stmt)).rowcount == 1
+            else:
+                try:
+                    async with conn.begin_nested():
+                        await conn.execute(insert(ProcessedUpdate).values(values))
+                    claimed = True
+                except IntegrityError:
+                    claimed = False
+
+            if now - self._last_purge > PURGE_INTERVAL:
+                self._last_purge = now
+                await conn.execute(delete(ProcessedUpdate).where(ProcessedUpdate.processed_at < now - self.ttl))
+
+        if not claimed:
+            self.duplicates += 1
+            logger.info(f"Update {update_id} was already processed by another worker, skipping it")
+        return claimed
+
+
+def create_deduplicator(store: str, window: int, ttl: float, engine=None) -> UpdateDeduplicator:
+    """Deduplicator for config.UPDATE_DEDUP_STORE ("memory" or "database")"""
+    dedup = UpdateDeduplicator(window=window, engine=engine if store == "database" else None, ttl=ttl)
+    metrics.register_gauge("updates_deduplicated", "Redelivered updates skipped since start",
+                           lambda: dedup.duplicates)
+    logger.info(f"Update deduplication: {window} recent ids in memory"
+                + (", shared claims in the database" if dedup.engine is not None else ""))
+    return dedup
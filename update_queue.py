@@ -0,0 +1,104 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update: dict):
+    """Telegram user id an update belongs to, or None for updates without a sender"""
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user')
+            if isinstance(sender, dict) and 'id' in sender:
+                return sender['id']
+    return None
+
+
+class UpdateQueue:
+    """
+    In-process queue that decouples webhook acknowledgement from update processing.
+
+    Updates are sharded by user id over ``workers`` queues, each drained by a
+    single worker task, so updates of one user are always processed in the
+    order they arrived while different users are processed concurrently.
+    ``submit()`` never waits: when a shard is full it returns False and the
+    caller should ask Telegram to redeliver later.
+    """
+
+    def __init__(self, process, workers: int = 4, max_size: int = 1000):
+        self.process = process
+        self.workers = max(workers, 1)
+        self.shard_size = max(max_size // self.workers, 1)
+        self._shards = []
+        self._tasks = []
+        self._closing = False
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def depth(self) -> int:
+        """Number of updates waiting to be processed"""
+        return sum(shard.qsize() for shard in self._shards)
+
+    def start(self):
+        """Start worker tasks on the running event loop"""
+        if self._tasks:
+            return
+        self._closing = False
+        self._shards = [asyncio.Queue(maxsize=self.shard_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(index, shard))
+            for index, shard in enumerate(self._shards)
+        ]
+        logger.info(f"Update queue started: {self.workers} workers, {self.shard_size} updates per worker")
+
+    def submit(self, update: dict) -> bool:
+        """Enqueue an update; returns False if it was rejected (queue full or shutting down)"""
+        if self._closing:
+            return False
+        if not self._tasks:
+            self.start()
+
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else update.get('update_id', 0)
+        shard = self._shards[hash(key) % self.workers]
+        try:
+            shard.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Update queue full, rejecting update_id={update.get('update_id')}")
+            return False
+
+    async def _worker(self, index: int, shard: asyncio.Queue):
+        while True:
+            update = await shard.get()
+            try:
+                await self.process(update)
+            except Exception as e:
+                logger.error(f"Worker {index} failed to process update_id={update.get('update_id')}: {e}",
+                             exc_info=True)
+            finally:
+                shard.task_done()
+
+    async def drain(self, timeout: float = 10.0):
+        """Stop accepting updates, wait for queued ones to finish, then stop the workers"""
+        if not self._tasks:
+            return
+        self._closing = True
+        pending = self.depth()
+        logger.info(f"Draining update queue ({pending} pending)")
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(shard.join() for shard in self._shards)),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Update queue drain timed out, {self.depth()} updates dropped")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._shards = []
+        logger.info("Update queue stopped")
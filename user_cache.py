@@ -0,0 +1,179 @@
+"""
+Cache of participants' registration details.
+
+Menu actions ("👤 Ro'yxatdan o'tish", "✏️ Ma'lumotlarni tahrirlash", the
+confirmation step) need to know whether a Telegram user is registered and,
+for editing, their current details. ``get_registration()`` keeps snapshots of
+registered participants in a bounded LRU/TTL cache. A snapshot checked less
+than ``USER_CACHE_TRUST`` seconds ago is used without touching the database;
+an older one is checked against the user row's ``revision`` (a token replaced
+on each write) with one narrow indexed query, instead of loading the user and
+address. Writes in this process replace or clear the entry right away, so a
+change or ``/clear_results`` on another worker process shows up here after at
+most ``USER_CACHE_TRUST`` seconds. "Not registered" is never cached.
+
+``UserCache`` is the backend interface (async, like the state storage), so a
+store shared between worker processes can be plugged in; the default
+``MemoryUserCache`` is per process.
+"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+import config
+import metrics
+from database import AsyncSessionLocal
+from models.User import User
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AddressSnapshot:
+    region_id: int = None
+    district_id: int = None
+    neighborhood: str = None
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    telegram_id: int
+    user_id: int = None
+    full_name: str = None
+    workplace: str = None
+    birth_date: str = None
+    passport_series: str = None
+    phone_number: str = None
+    address: AddressSnapshot = None
+    revision: int = None
+    # Wall-clock time the snapshot was last known to match the database
+    checked_at: float = field(default_factory=time.time, compare=False)
+
+    @property
+    def registered(self) -> bool:
+        return self.user_id is not None
+
+
+def snapshot(telegram_id: int, user: User = None) -> UserSnapshot:
+    """Immutable copy of a (loaded) user and its address; ``user=None`` means not registered"""
+    if user is None:
+        return UserSnapshot(telegram_id)
+    address = None
+    if user.address is not None:
+        address = AddressSnapshot(user.address.region_id, user.address.district_id, user.address.neighborhood)
+    return UserSnapshot(
+        telegram_id=telegram_id,
+        user_id=user.id,
+        full_name=user.full_name,
+        workplace=user.workplace,
+        birth_date=user.birth_date,
+        passport_series=user.passport_series,
+        phone_number=user.phone_number,
+        address=address,
+        revision=user.revision,
+    )
+
+
+class UserCache:
+    """Backend interface"""
+
+    async def get(self, telegram_id: int) -> UserSnapshot:
+        raise NotImplementedError
+
+    async def put(self, entry: UserSnapshot):
+        raise NotImplementedError
+
+    async def invalidate(self, telegram_id: int):
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+
+class MemoryUserCache(UserCache):
+    """Per-process LRU cache; entries not read for ``ttl`` seconds expire"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, telegram_id: int) -> UserSnapshot:
+        item = self._entries.get(telegram_id)
+        if item is None or time.monotonic() - item[1] > self.ttl:
+            self.misses += 1
+            return None
+        self._entries[telegram_id] = (item[0], time.monotonic())
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return item[0]
+
+    async def put(self, entry: UserSnapshot):
+        self._entries[entry.telegram_id] = (entry, time.monotonic())
+        self._entries.move_to_end(entry.telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, telegram_id: int):
+        self._entries.pop(telegram_id, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache: UserCache = MemoryUserCache(max_size=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+
+if isinstance(cache, MemoryUserCache):
+    metrics.register_gauge("user_cache_entries", "Participants in the registration cache", lambda: len(cache))
+    metrics.register_gauge("user_cache_hits", "Registration cache hits since start", lambda: cache.hits)
+    metrics.register_gauge("user_cache_misses", "Registration cache misses since start", lambda: cache.misses)
+
+# Cached snapshots found outdated by the revision check
+_stale = 0
+metrics.register_gauge("user_cache_stale", "Cached registrations changed by another process since start",
+                       lambda: _stale)
+
+
+async def get_registration(telegram_id: int) -> UserSnapshot:
+    """Registration status and details of a Telegram user; cached details are used while still current"""
+    global _stale
+    entry = await cache.get(telegram_id)
+    if entry is not None and time.time() - entry.checked_at < config.USER_CACHE_TRUST:
+        return entry
+    async with AsyncSessionLocal() as db:
+        if entry is not None:
+            current = (await db.execute(
+                select(User.id, User.revision).where(User.telegram_id == telegram_id)
+            )).first()
+            if current is not None and tuple(current) == (entry.user_id, entry.revision):
+                entry = replace(entry, checked_at=time.time())
+                await cache.put(entry)
+                return entry
+            _stale += 1
+        user = await db.scalar(
+            select(User).options(joinedload(User.address)).where(User.telegram_id == telegram_id)
+        )
+        entry = snapshot(telegram_id, user)
+    if entry.registered:
+        await cache.put(entry)
+    else:
+        await cache.invalidate(telegram_id)
+    return entry
+
+
+async def remember(entry: UserSnapshot):
+    """Store the snapshot of a participant after a committed write"""
+    await cache.put(entry)
+
+
+async def clear():
+    await cache.clear()